@@ -1,15 +1,65 @@
+import atexit
 import csv
+import hashlib
+import heapq
+import importlib.metadata
+import importlib.util
 import json
 import os.path
+import re
+import shutil
 import subprocess
+import sys
+import textwrap
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from typing import Callable, Iterable, Iterator
 from urllib.parse import urlparse
 
 from dateutil.relativedelta import relativedelta
 
-from pydriller import Repository, Git
+from pydriller import Git, Repository
 import uuid
 from tqdm import tqdm
+import numpy as np
+
+import repo_root  # puts the top of the repository on sys.path
+from commit_index import CommitIndex
+from snapshot_manifest import cached_manifest, diff_manifests
+from snapshot_reader import SnapshotReader, ls_tree, matches_patterns, python_patterns
+from detection_cache import DetectionCache
+from detector_server import DetectorClient, LocalDetector, feature_names
+from near_duplicates import MinHashIndex, snapshot_index
+
+# Copy of the installed botsniffer package owned by this (worker) process, see use_private_botsniffer.
+# None runs the botsniffer command, which trains into the one model file of the installed package
+botsniffer_package_dir = None
+
+# Identify files through a long-lived detector_server.py process per (worker) process, which keeps
+# the models loaded, instead of a botsniffer --identify run per commit
+use_detector_server = True
+# Handle the detector's requests in this (worker) process with features.py, one parse per file,
+# instead of in a detector_server.py child process
+use_in_process_detector = True
+# This process's detector, started on first use
+detector = None
+
+# Model used by analyze_commit_stream unless it is given another training corpus
+default_training_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "botsniffervalid")
+
+# Files sent to the detector server in one request by analyze_commit_stream
+stream_batch_size = 200
+
+# Guess of the analysis time per byte of Python code, until a repository has a measured rate in
+# <temp_dir>/job_history.json
+default_seconds_per_byte = 2e-5
+# Fixed cost of one file (opening, parsing, predicting), in bytes of code: fitting the time of
+# features.py on the standard library gives about 3.5 ms a file plus 1.4 us a byte
+bytes_per_file = 2400
+
+# One feature in a botsniffer "Features:" line, e.g. 'code_complexity': np.float64(0.5) or 'comment_quality': 2.0
+feature_pattern = re.compile(r"'(\w+)': (?:np\.float64\()?([-+\w.]+)\)?")
 
 # List of GitHub repository URLs
 repo_url_links = [
@@ -62,6 +112,13 @@ repo_url_links = [
 ]
 
 
+class TrainingError(RuntimeError):
+    """
+    botsniffer could not train a model on a training set (e.g. a file in it doesn't parse).
+    Whatever model is on disk belongs to another training set and must not be used instead
+    """
+
+
 def dir_from_repo_url(repo_url: str, root_dir: str) -> str:
     """
     Construct a directory path of git repository in a given directory that exists already
@@ -108,10 +165,295 @@ def download_repos(root_dir: str, repo_urls: list[str]) -> None:
     for repo_url in repo_urls:
         subprocess.run(args= ["git", "clone", repo_url, dir_from_repo_url(repo_url, root_dir)])
 
+def botsniffer_command(args: list[str]) -> tuple[list[str], dict | None]:
+    """
+    (command, environment) running botsniffer with the given arguments, from this process's
+    private copy of the package if it has one
+    """
+    if botsniffer_package_dir is None:
+        return ["botsniffer"] + args, None
+    python_path = os.pathsep.join(filter(None, [botsniffer_package_dir, os.environ.get("PYTHONPATH")]))
+    return [sys.executable, "-m", "botsniffer.scanner"] + args, dict(os.environ, PYTHONPATH=python_path)
+
+def identify_with_botsniffer(path: str) -> list[dict]:
+    """
+    botsniffer --identify path, parsed while it runs
+    """
+    command, env = botsniffer_command(["--identify", path])
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True)
+    with process.stdout:
+        records = list(parse_botsniffer_stream(process.stdout))
+    process.wait()
+    return records
+
+def use_private_botsniffer(temp_dir: str) -> None:
+    """
+    Process pool initializer. train_botsniffer puts each commit's model inside the package folder,
+    where botsniffer --identify reads it, so every worker process gets its own copy of the package
+    and never reads another one's model
+    """
+    global botsniffer_package_dir
+    package_dir = os.path.dirname(importlib.util.find_spec("botsniffer").origin)
+    botsniffer_package_dir = os.path.abspath(os.path.join(temp_dir, "workers", str(os.getpid())))
+    target_dir = os.path.join(botsniffer_package_dir, "botsniffer")
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+    shutil.copytree(package_dir, target_dir, ignore=shutil.ignore_patterns("__pycache__"))
+
+def botsniffer_model_path() -> str:
+    """
+    The model file botsniffer --identify reads, where train_botsniffer puts the current model
+    """
+    if botsniffer_package_dir is None:
+        package_dir = os.path.dirname(importlib.util.find_spec("botsniffer").origin)
+    else:
+        package_dir = os.path.join(botsniffer_package_dir, "botsniffer")
+    return os.path.join(package_dir, "data", "botcode.pkl")
+
+def training_label(train_path: str) -> bool:
+    """
+    botsniffer --train's label for a file, from the path it would be given: <owner>/<repo>/... for a
+    checkout, the path inside a corpus (see train_botsniffer), never where the folder is on disk
+    """
+    return "ai" in train_path.lower()
+
+def training_key(samples: list[tuple[bool, str]]) -> str:
+    """
+    Identifies a botsniffer model by what it was trained on: (label, content hash) of every
+    training file, and the botsniffer version. A file's features only depend on its content
+    and its label on training_label, so the same training set has the same key in any checkout
+    """
+    digest = hashlib.sha256(importlib.metadata.version("botsniffer").encode())
+    for label, content_hash in sorted(samples):
+        digest.update(f"\n{int(label)} {content_hash}".encode())
+    return digest.hexdigest()
+
+def repo_training_path(train_dir: str) -> str:
+    """
+    Path a <owner>/<repo> checkout's training files are labelled by (see training_label).
+    It is always <owner>/<repo>, wherever the checkout (a clone under root_dir or a worker's
+    worktree) is
+    """
+    train_dir = os.path.abspath(train_dir)
+    return os.path.relpath(train_dir, os.path.dirname(os.path.dirname(train_dir)))
+
+def repo_training_files(train_dir: str, commit_hash: str) -> list[tuple[bool, str, str]]:
+    """
+    (label, blob hash, file path) of the training set of a checkout at commit_hash, from git ls-tree
+    """
+    train_path = repo_training_path(train_dir)
+    return [(training_label(os.path.join(train_path, entry.path)), entry.blob_hash, os.path.join(train_dir, entry.path))
+            for entry in ls_tree(train_dir, commit_hash, python_patterns) if entry.mode in ("100644", "100755")]
+
+def corpus_training_files(corpus_dir: str) -> list[tuple[bool, str, str]]:
+    """
+    (label, blob hash, file path) of the training set of a folder that is not a checkout. Labels
+    come from the path inside the corpus (ai_generated/ or human_written/), not where it is on disk
+    """
+    training_files = []
+    for root, _, files in os.walk(corpus_dir):
+        for file_name in files:
+            if file_name.endswith(".py"):
+                file_path = os.path.join(root, file_name)
+                with open(file_path, "rb") as file:
+                    blob_hash = blob_hash_of(file.read())
+                training_files.append((training_label(os.path.relpath(file_path, corpus_dir)), blob_hash, file_path))
+    return training_files
+
+def train_botsniffer(train_dir: str, commit_hash: str, model_store_dir: str, training_corpus: str | None = None, cache: DetectionCache | None = None) -> str:
+    """
+    Put the model for this training set where botsniffer --identify reads it: copied from
+    model_store_dir if the same set was trained on before, otherwise trained like botsniffer --train
+    does (its decision tree, on the five features) and stored there. Features come from the cache
+    when it has them, so only files never seen before are parsed. With training_corpus, every
+    commit uses the one model trained on that folder instead of a model trained on the repository itself.
+    Files that don't parse are left out of the training set.
+    Returns the model's key (see training_key), the model is <model_store_dir>/<key>.pkl.
+    Raises TrainingError if no file could be trained on
+    """
+    if training_corpus is not None:
+        training_files = corpus_training_files(training_corpus)
+    else:
+        training_files = repo_training_files(train_dir, commit_hash)
+    model_key = training_key([(label, blob_hash) for label, blob_hash, _ in training_files])
+    stored_path = os.path.join(model_store_dir, model_key + ".pkl")
+
+    if not os.path.exists(stored_path):
+        from botsniffer.ml_model.model import train_model
+        file_paths = {blob_hash: file_path for _, blob_hash, file_path in training_files}
+        blob_features = features_of_blobs(list(file_paths), lambda blob_hash: {"path": file_paths[blob_hash]}, cache)
+        labels = []
+        samples = []
+        for label, blob_hash, _ in training_files:
+            if blob_hash in blob_features:
+                labels.append(int(label))
+                samples.append([blob_features[blob_hash][name] for name in feature_names])
+        if not samples:
+            raise TrainingError(f"no training file of {training_corpus or train_dir} could be parsed")
+        os.makedirs(model_store_dir, exist_ok=True)
+        temp_path = f"{stored_path}.{os.getpid()}.tmp"
+        train_model(temp_path, labels, samples)
+        os.replace(temp_path, stored_path)
+
+    # botsniffer --identify and identify_folder read the model from the package folder
+    model_path = botsniffer_model_path()
+    temp_path = f"{model_path}.{os.getpid()}.tmp"
+    shutil.copyfile(stored_path, temp_path)
+    os.replace(temp_path, model_path)
+    return model_key
+
+def stored_model_path(temp_dir: str, model_key: str) -> str:
+    return os.path.join(temp_dir, "models", f"{model_key}.pkl")
+
+def feature_extractor() -> str:
+    """
+    Name and version of the code extracting features for this process (see DetectionCache)
+    """
+    version = importlib.metadata.version("botsniffer")
+    return f"features.py {version}" if use_detector_server else f"botsniffer {version}"
+
+def open_cache(detection_cache: str | None) -> DetectionCache | None:
+    return DetectionCache(detection_cache, feature_extractor()) if detection_cache else None
+
+def features_of_blobs(blob_hashes: list[str], file_request: Callable[[str], dict], cache: DetectionCache | None = None, desc: str | None = None) -> dict[str, dict[str, float]]:
+    """
+    {blob hash: features} from the cache, and extracted (then cached) for the blobs it doesn't
+    have. file_request(blob_hash) gives the detector request for a blob, {"path"} or {"name", "content"},
+    and is only called for blobs missing from the cache. Blobs that don't parse are left out
+    """
+    found = cache.get_many(blob_hashes) if cache is not None else {}
+    missing = [blob_hash for blob_hash in dict.fromkeys(blob_hashes) if blob_hash not in found]
+    batches = range(0, len(missing), stream_batch_size)
+    for i in tqdm(batches, desc=desc) if desc else batches:
+        batch = missing[i:i + stream_batch_size]
+        results = get_detector().request([file_request(blob_hash) for blob_hash in batch], predict=False)
+        extracted = [(blob_hash, result["features"]) for blob_hash, result in zip(batch, results) if "error" not in result]
+        found.update(extracted)
+        if cache is not None:
+            cache.put_many(extracted)
+    return found
+
+def predict_features(named_features: dict[str, tuple[str, dict[str, float]]], model_path: str) -> dict[str, dict]:
+    """
+    {key: result} for {key: (file name, features)}, every verdict given by the model at model_path
+    """
+    keys = list(named_features)
+    results = {}
+    for i in range(0, len(keys), stream_batch_size):
+        batch = keys[i:i + stream_batch_size]
+        results.update(zip(batch, get_detector().predict([named_features[key] for key in batch], model_path)))
+    return results
+
+def get_detector() -> DetectorClient:
+    global detector
+    if detector is None:
+        if not use_detector_server:
+            # Features of cached modes and training from botsniffer's own code, like botsniffer --identify
+            detector = LocalDetector(botsniffer_features=True)
+        elif use_in_process_detector:
+            detector = LocalDetector()
+        else:
+            detector = DetectorClient()
+        atexit.register(detector.close)
+    return detector
+
+def detector_results(file_paths: list[str]) -> list[dict]:
+    """
+    Results of the detector server for these files, with the model botsniffer --identify would use,
+    in the format of parse_botsniffer_stream. Files it could not parse are left out, like botsniffer
+    leaves out everything after such a file
+    """
+    return [result for result in get_detector().identify(file_paths, botsniffer_model_path()) if "error" not in result]
+
+def identify_folder(folder: str) -> list[dict]:
+    """
+    Results for every Python file under folder, like botsniffer --identify folder
+    """
+    if use_detector_server:
+        file_paths = []
+        for root, _, files in os.walk(folder):
+            file_paths.extend(os.path.join(root, file_name) for file_name in files if file_name.endswith(".py"))
+        return detector_results(file_paths)
+    return identify_with_botsniffer(folder)
+
+def checkpoint_config(incremental: bool, training_corpus: str | None) -> str:
+    """
+    Hash of the settings a commit's results depend on. Checkpoint records of a run with other
+    settings are not reused
+    """
+    if not use_detector_server:
+        detector_kind = "botsniffer"
+    else:
+        detector_kind = "in-process" if use_in_process_detector else "server"
+    settings = {
+        "botsniffer": importlib.metadata.version("botsniffer"),
+        "incremental": incremental,
+        "training": training_key([file[:2] for file in corpus_training_files(training_corpus)]) if training_corpus else "repository",
+        "detector": detector_kind,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def load_checkpoint(checkpoint_file: str | None, config: str) -> dict[tuple[str, str, str], dict]:
+    """
+    Commit entries finished by earlier runs with the same config (see checkpoint_config), keyed
+    by (repository path, date, commit). A last line cut short by a killed run is ignored
+    """
+    finished = {}
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return finished
+    with open(checkpoint_file, "r") as file:
+        content = file.read()
+    for line in content.splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if record.get("config") != config:
+            continue
+        finished[(record["repository_path"], record["date"], record["commit"])] = {
+            "date": datetime.fromisoformat(record["date"]),
+            "commit": record["commit"],
+            "data": record["data"],
+            "found_commit": True
+        }
+    if content and not content.endswith("\n"):
+        # Next records start on a line of their own
+        with open(checkpoint_file, "a") as file:
+            file.write("\n")
+    return finished
+
+def save_checkpoint(checkpoint_file: str, config: str, repository_path: str, commit: dict) -> None:
+    """
+    Append a finished commit entry to the checkpoint, on disk before the run goes on
+    """
+    record = {
+        "config": config,
+        "repository_path": repository_path,
+        "date": commit["date"].isoformat(),
+        "commit": commit["commit"],
+        "data": commit["data"]
+    }
+    with open(checkpoint_file, "a") as file:
+        file.write(json.dumps(record) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+def training_failed(date: datetime, commit_hash: str, error: TrainingError) -> dict:
+    """
+    Commit entry for a commit whose model could not be trained: no results, and the error
+    """
+    return {
+        "date": date,
+        "commit": commit_hash,
+        "data": [],
+        "found_commit": True,
+        "error": str(error)
+    }
+
 def assert_dir(directory: str):
     assert(os.path.exists(directory))
 
-def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str], root_dir: str, temp_dir: str) -> list[dict]:
+def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str], root_dir: str, temp_dir: str, incremental: bool = False, workers: int = 1, training_corpus: str | None = None, detection_cache: str | None = None, checkpoint_file: str | None = None) -> list[dict]:
     """
     Analyse github repositories in a directory for AI usage with botsniffer
     Analyze the repository at 4 commits:
@@ -119,11 +461,30 @@ def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str],
         - Just before GPT-4 release
         - 104 Days after GPT-4 release
         - Latest commit (6 march 2025)
+    With incremental=True only the files that changed since the previous date are parsed again,
+    the features of the other files are carried over and predicted with the date's model (see
+    identify_changed_files)
+    With workers > 1 the (repository, date) jobs run in a process pool, see analyze_repos_in_parallel
+    Trained models are kept in <temp_dir>/models and reused whenever the training files are the
+    same. Set training_corpus (e.g. botsniffer/botsniffervalid) to train once on that folder and
+    use the one model for every commit
+    detection_cache is an SQLite file of features per blob (see DetectionCache): a file whose
+    content was seen before, at any date, in any repository or for training, is only predicted
+    with the current model, never parsed again
+    With checkpoint_file, every finished commit is appended to that JSONL file right away, and
+    commits already in it (from a run with the same settings, see checkpoint_config) are not
+    analyzed again, so a failed or killed run picks up where it stopped
     """
+    if workers > 1:
+        return analyze_repos_in_parallel(dates_to_analyze, repo_urls, root_dir, temp_dir, incremental, workers, training_corpus, detection_cache, checkpoint_file)
+
     # check if temp dir exists
     if not os.path.exists(temp_dir):
         os.mkdir(temp_dir)
     ret = []
+    cache = open_cache(detection_cache)
+    config = checkpoint_config(incremental, training_corpus)
+    finished = load_checkpoint(checkpoint_file, config)
     pbar = tqdm(repo_urls, position=0)
 
     for repo_url in pbar:
@@ -142,8 +503,13 @@ def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str],
             "repository_path": repo_path,
             "commits": []
         })
+        # Built once per repository, every date is then a binary search
+        index = CommitIndex.load(repo_path)
+        manifest_dir = dir_from_repo_url(repo_url, os.path.join(temp_dir, "manifests"))
+        # (manifest, {path: result}) of the previous date, for incremental runs
+        previous = None
         for date in dates_to_analyze:
-            commit_hash = getCommitOnDate(date, repo_path)
+            commit_hash = getCommitOnDate(date, repo_path, index)
             pbar.set_description(pbar_desc_format + f"\nDate: {date}\nCommit: {commit_hash}")
             if commit_hash is None:
                 # print(f"Could not find commit after date: {date}")
@@ -152,9 +518,14 @@ def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str],
                     "commit_hash": "NOT FOUND",
                     "found_commit": False
                 })
+            elif (repo_path, date.isoformat(), commit_hash) in finished:
+                commit = finished[(repo_path, date.isoformat(), commit_hash)]
+                ret[-1]["commits"].append(commit)
+                if incremental:
+                    results = {os.path.relpath(result["file"], repo_path): result for result in commit["data"]}
+                    previous = (cached_manifest(repo_path, commit_hash, manifest_dir), results)
             else:
                 gr = Git(path= repo_path)
-                temp_file_path = os.path.join(temp_dir, uuid.uuid4().hex[:8]) + ".out"
                 # Try catch in case something breaks, we still need to restore git repository to master branch
                 # or sometimes pydriller can't find commits when the repo is in a detatched head mode.
                 try:
@@ -164,19 +535,28 @@ def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str],
                     # print(f"Analyzing {commit_hash} ({date})\n")
                     gr.checkout(commit_hash)
 
-                    subprocess.run(args=["botsniffer", "--train", repo_path], capture_output=True)
+                    try:
+                        model_key = train_botsniffer(repo_path, commit_hash, os.path.join(temp_dir, "models"), training_corpus, cache)
+                    except TrainingError as e:
+                        # No model for this commit: no verdicts either, and not checkpointed so a rerun tries again
+                        ret[-1]["commits"].append(training_failed(date, commit_hash, e))
+                        gr.reset()
+                        continue
 
-                    # Create a file name for this run to store the botsniffer output
-
-                    with open(temp_file_path, "w+") as file:
-                        subprocess.run(args=["botsniffer", "--identify", repo_path], stdout=file)
+                    if incremental or cache is not None:
+                        # Without incremental, every file is "changed" and looked up in the cache
+                        data, previous = identify_changed_files(repo_path, commit_hash, previous if incremental else None, manifest_dir, stored_model_path(temp_dir, model_key), cache)
+                    else:
+                        data = identify_folder(repo_path)
 
                     ret[-1]["commits"].append({
                         "date": date,
                         "commit": commit_hash,
-                        "data": parseBotsnifferOutput(temp_file_path),
+                        "data": data,
                         "found_commit": True
                     })
+                    if checkpoint_file:
+                        save_checkpoint(checkpoint_file, config, repo_path, ret[-1]["commits"][-1])
 
                     # Need to reset repository or sometime pydriller can't find commits
                     gr.reset()
@@ -184,7 +564,6 @@ def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str],
                     gr.reset()
                     err_msg = f"""
                     Error: {e}
-                    File Path: [red] {temp_file_path} [/red]
                     Repository: {repo_url}
                     Repository has been reset to master branch
                     """
@@ -192,39 +571,605 @@ def analyze_repos_for_ai(dates_to_analyze: list[datetime], repo_urls: list[str],
 
     return ret
 
-def parseBotsnifferOutput(file_path: str) -> list[dict]:
+def analyze_dates_in_worktree(repo_path: str, jobs: list[tuple[int, datetime, str]], temp_dir: str, manifest_dir: str, incremental: bool, training_corpus: str | None = None, detection_cache: str | None = None) -> list[tuple[int, dict]]:
+    """
+    Worker side of analyze_repos_in_parallel: train and identify at each (position, date, commit) in
+    a worktree of its own, so the shared clone is never checked out. File paths in the results
+    are given relative to repo_path like analyze_repos_for_ai does.
+    Returns (position, commit entry) for each job
+    """
+    # Ends in <owner>/<repo> like repo_path, which is what botsniffer --train is given (see repo_training_path)
+    owner_and_repo = os.path.normpath(repo_path).split(os.sep)[-2:]
+    worktree_dir = os.path.abspath(os.path.join(temp_dir, "worktrees", uuid.uuid4().hex[:8], *owner_and_repo))
+    subprocess.run(["git", "worktree", "add", "-q", "--detach", worktree_dir, jobs[0][2]], cwd=repo_path, check=True, capture_output=True)
     ret = []
-    with open(file_path, "r") as file:
-        lines = file.readlines()
-        if len(lines) <= 3:
-            return ret
-        for i in range(0, len(lines), 3):
-            if "Done!" in lines[i]:
-                break
-            file_path = lines[i].split(' ', 1)[1]
-            is_ai = True if "True" in lines[i + 1] else False
-            features = lines[i + 2].split(' ', 1)[1]
+    previous = None
+    cache = open_cache(detection_cache)
+    try:
+        for position, date, commit_hash in jobs:
+            subprocess.run(["git", "checkout", "-q", "--detach", commit_hash], cwd=worktree_dir, check=True, capture_output=True)
+            try:
+                model_key = train_botsniffer(worktree_dir, commit_hash, os.path.join(temp_dir, "models"), training_corpus, cache)
+            except TrainingError as e:
+                # The model on disk is from this worker's previous job, like the serial run the commit gets no results
+                ret.append((position, training_failed(date, commit_hash, e)))
+                continue
+            if incremental or cache is not None:
+                data, previous = identify_changed_files(worktree_dir, commit_hash, previous if incremental else None, manifest_dir, stored_model_path(temp_dir, model_key), cache)
+            else:
+                data = identify_folder(worktree_dir)
+            for result in data:
+                if result["file"].startswith(worktree_dir + os.sep):
+                    result["file"] = os.path.join(repo_path, os.path.relpath(result["file"], worktree_dir))
+            ret.append((position, {
+                "date": date,
+                "commit": commit_hash,
+                "data": data,
+                "found_commit": True
+            }))
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", worktree_dir], cwd=repo_path, capture_output=True)
+        shutil.rmtree(os.path.dirname(os.path.dirname(worktree_dir)), ignore_errors=True)
+        if cache is not None:
+            cache.close()
+    return ret
+
+def job_size(repo_path: str, jobs: list[tuple[int, datetime, str]]) -> tuple[int, int]:
+    """
+    (Python files, bytes of Python code) a job has to go through, from git ls-tree of its commits
+    """
+    num_files = num_bytes = 0
+    for _, _, commit_hash in jobs:
+        entries = ls_tree(repo_path, commit_hash, python_patterns)
+        num_files += len(entries)
+        num_bytes += sum(entry.size for entry in entries)
+    return num_files, num_bytes
+
+def job_cost(num_files: int, num_bytes: int) -> int:
+    """
+    Size of a job in bytes of code, counting bytes_per_file for every file it goes through
+    """
+    return num_bytes + bytes_per_file * num_files
+
+def load_job_history(temp_dir: str) -> dict[str, float]:
+    """
+    {repository path: seconds per byte of job_cost measured by the last run}
+    """
+    history_file = os.path.join(temp_dir, "job_history.json")
+    if not os.path.exists(history_file):
+        return {}
+    with open(history_file, "r") as file:
+        return json.load(file)
+
+def save_job_history(temp_dir: str, history: dict[str, float]) -> None:
+    history_file = os.path.join(temp_dir, "job_history.json")
+    temp_path = f"{history_file}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(history, file, indent=1)
+    os.replace(temp_path, history_file)
+
+def predict_job_seconds(repo_path: str, cost: int, history: dict[str, float]) -> float:
+    """
+    Estimated time of a job: its job_cost at the repository's measured rate, or at the median rate
+    of the measured repositories (default_seconds_per_byte if there are none)
+    """
+    if repo_path in history:
+        rate = history[repo_path]
+    elif history:
+        rate = sorted(history.values())[len(history) // 2]
+    else:
+        rate = default_seconds_per_byte
+    return rate * cost
+
+def longest_first_makespan(job_seconds: list[float], workers: int) -> float:
+    """
+    Makespan of the jobs dispatched longest first, each to the worker that frees up first
+    """
+    loads = [0.0] * workers
+    for seconds in sorted(job_seconds, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + seconds)
+    return max(loads)
+
+def timed_job(function, *args) -> tuple[float, object]:
+    """
+    (seconds it took, result) of function(*args), run in a worker
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def analyze_repos_in_parallel(dates_to_analyze: list[datetime], repo_urls: list[str], root_dir: str, temp_dir: str, incremental: bool, workers: int, training_corpus: str | None = None, detection_cache: str | None = None, checkpoint_file: str | None = None) -> list[dict]:
+    """
+    analyze_repos_for_ai with a pool of worker processes, one (repository, date) job each.
+    With incremental=True a job is a whole repository instead, since each date reuses the results
+    of the one before. Commits found in checkpoint_file are not analyzed again, and the others are
+    appended to it as their jobs finish.
+    Jobs are dispatched longest first, estimated from their Python files and bytes (job_cost) and
+    the rate measured for the repository by earlier runs, so the big repositories don't make a long
+    tail at the end. The predicted and actual makespans are printed at the end.
+    Returns the same structure as the serial run
+    """
+    if not os.path.exists(temp_dir):
+        os.mkdir(temp_dir)
+    config = checkpoint_config(incremental, training_corpus)
+    finished = load_checkpoint(checkpoint_file, config)
+    history = load_job_history(temp_dir)
+    ret = []
+    scheduled = []
+    futures = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=use_private_botsniffer, initargs=(temp_dir,)) as pool:
+        for repo_url in repo_urls:
+            repo_path = dir_from_repo_url(repo_url, root_dir)
+            if not os.path.exists(os.path.join(repo_path, ".git")):
+                continue
+            commits = [None] * len(dates_to_analyze)
             ret.append({
-                "file": file_path,
-                "is_ai": is_ai,
-                "features": features
+                "repository_path": repo_path,
+                "commits": commits
             })
+            # Built here once, so the workers only read it
+            index = CommitIndex.load(repo_path)
+            manifest_dir = dir_from_repo_url(repo_url, os.path.join(temp_dir, "manifests"))
+            jobs = []
+            for position, date in enumerate(dates_to_analyze):
+                commit_hash = getCommitOnDate(date, repo_path, index)
+                if commit_hash is None:
+                    commits[position] = {
+                        "date": date,
+                        "commit_hash": "NOT FOUND",
+                        "found_commit": False
+                    }
+                elif (repo_path, date.isoformat(), commit_hash) in finished:
+                    commits[position] = finished[(repo_path, date.isoformat(), commit_hash)]
+                else:
+                    jobs.append((position, date, commit_hash))
+            job_groups = [jobs] if incremental and jobs else [[job] for job in jobs]
+            for job_group in job_groups:
+                cost = job_cost(*job_size(repo_path, job_group))
+                predicted = predict_job_seconds(repo_path, cost, history)
+                scheduled.append((predicted, cost, repo_url, repo_path, commits, manifest_dir, job_group))
+
+        # The pool hands out jobs in submission order, so the longest ones go first
+        scheduled.sort(key=lambda job: job[0], reverse=True)
+        start = time.perf_counter()
+        for predicted, cost, repo_url, repo_path, commits, manifest_dir, job_group in scheduled:
+            future = pool.submit(timed_job, analyze_dates_in_worktree, repo_path, job_group, temp_dir, manifest_dir, incremental, training_corpus, detection_cache)
+            futures[future] = (repo_url, repo_path, commits, cost)
+
+        # First failed job. The jobs still running are let finish and checkpointed before it is raised
+        failure = None
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Analyzing (repository, date) jobs"):
+            repo_url, repo_path, commits, cost = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                seconds, results = future.result()
+            except Exception as e:
+                if failure is None:
+                    failure = (repo_url, e)
+                    for other_future in futures:
+                        other_future.cancel()
+                continue
+            for position, commit in results:
+                commits[position] = commit
+                if checkpoint_file and "error" not in commit:
+                    save_checkpoint(checkpoint_file, config, repo_path, commit)
+            if cost > 0:
+                history[repo_path] = seconds / cost
+
+    if failure is not None:
+        shutil.rmtree(os.path.join(temp_dir, "workers"), ignore_errors=True)
+        raise Exception(f"""
+                    Error: {failure[1]}
+                    Repository: {failure[0]}
+                    """)
+    # Every worker has exited, their private botsniffer copies (see use_private_botsniffer) can go
+    shutil.rmtree(os.path.join(temp_dir, "workers"), ignore_errors=True)
+    if scheduled:
+        predicted_makespan = longest_first_makespan([job[0] for job in scheduled], workers)
+        print(f"{len(scheduled)} jobs on {workers} workers: predicted makespan {predicted_makespan:.1f}s, "
+              f"actual {time.perf_counter() - start:.1f}s")
+        save_job_history(temp_dir, history)
     return ret
 
-def getCommitOnDate(date: datetime, repo_path: str) -> str | None:
+def parse_botsniffer_stream(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Records of botsniffer --identify output as {"file", "is_ai", "features": {name: float}},
+    yielded as soon as each one is read. A record with a missing or garbled line (or without all
+    five features) is dropped and parsing picks up again at the next "File:" line
+    """
+    record = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("File: "):
+            record = {"file": line[len("File: "):].strip()}
+        elif record is None:
+            # "Done!", error messages or the rest of a dropped record
+            continue
+        elif line.startswith("AI: ") and "is_ai" not in record:
+            record["is_ai"] = line[len("AI: "):].strip() == "True"
+        elif line.startswith("Features: ") and "is_ai" in record:
+            features = {name: float(value) for name, value in feature_pattern.findall(line)}
+            if set(features) == set(feature_names):
+                record["features"] = features
+                yield record
+            record = None
+        else:
+            record = None
+
+def parseBotsnifferOutput(file_path: str) -> list[dict]:
     """
-    Returns the first commit hash after a specified date
+    Records of a botsniffer --identify output saved to a file
+    """
+    with open(file_path, "r") as file:
+        return list(parse_botsniffer_stream(file))
+
+def identify_changed_files(repo_path: str, commit_hash: str, previous: tuple | None, manifest_dir: str, model_path: str, cache: DetectionCache | None = None) -> tuple[list[dict], tuple]:
+    """
+    Identify only the Python files that differ from the previous analyzed commit, with the model
+    at model_path. The repository must already be checked out at commit_hash.
+    The diff uses the commits' manifests, folders whose tree hash did not change are not looked into.
+    Unchanged files are not parsed again: their features are carried over from the previous
+    commit and predicted with this commit's model, which may have been trained on other files.
+    With a cache, changed files whose blob was seen before (at any commit, with any model) are
+    not parsed again either, only predicted from their cached features.
+    Files that can't be parsed are left out.
+    Returns (results for every Python file, state to pass as previous for the next commit)
+    """
+    manifest = cached_manifest(repo_path, commit_hash, manifest_dir)
+    old_manifest, old_results = previous if previous else (None, {})
+    diff = diff_manifests(old_manifest, manifest)
+
+    file_features = {path: old_results[path]["features"] for path in diff["unchanged"] if path in old_results}
+    # Unchanged files without a result (e.g. they didn't parse) are tried again
+    to_identify = diff["changed"] + [path for path in diff["unchanged"] if path not in old_results]
+
+    blob_paths = {}
+    for path in to_identify:
+        blob_paths.setdefault(manifest["files"][path][0], path)
+    blob_features = features_of_blobs(list(blob_paths), lambda blob_hash: {"path": os.path.join(repo_path, blob_paths[blob_hash])}, cache)
+    for path in to_identify:
+        if manifest["files"][path][0] in blob_features:
+            file_features[path] = blob_features[manifest["files"][path][0]]
+    results = predict_features({path: (os.path.join(repo_path, path), features) for path, features in file_features.items()}, model_path)
+
+    return list(results.values()), (manifest, results)
+
+def getCommitOnDate(date: datetime, repo_path: str, index: CommitIndex | None = None) -> str | None:
+    """
+    Returns the first commit hash after a specified date (within 2 days).
+    If nothing was committed in that window, returns the last commit before the date,
+    which is what the repository looked like on that day
     """
     if not os.path.exists(os.path.join(repo_path, ".git")):
         # print("returning none?")
         return None
 
-    # print(date)
+    if index is None:
+        index = CommitIndex.load(repo_path)
     end_date = date + relativedelta(days=2)
-    # print(repo_path)
-    for commit in Repository(path_to_repo= repo_path, since= date, to=end_date).traverse_commits():
-        # print(commit)
-        return commit.hash
+    return index.commit_after(date, until=end_date) or index.commit_before(date)
+
+def changed_python_files(repo_path: str, commit_hashes: list[str], diff_filter: str = "AM") -> dict[str, list[tuple[str, str]]]:
+    """
+    {commit: [(path, new blob hash)]} of the Python files each commit adds or modifies (or
+    changes as git diff-tree's diff_filter says), from a single git diff-tree pass over all the
+    commits. Only regular files count, not symlinks or submodules named *.py. Merge commits
+    have no entry, their changes are counted in the commits that made them
+    """
+    output = subprocess.run(
+        ["git", "diff-tree", "--stdin", "-r", "-z", "--root", f"--diff-filter={diff_filter}"],
+        cwd=repo_path, input="".join(f"{commit_hash}\n" for commit_hash in commit_hashes).encode(), capture_output=True, check=True
+    ).stdout
+    changed = {}
+    fields = iter(output.split(b"\0"))
+    commit_hash = None
+    for field in fields:
+        if not field:
+            continue
+        if not field.startswith(b":"):
+            commit_hash = field.decode().strip()
+            changed[commit_hash] = []
+            continue
+        _, new_mode, _, blob_hash, _ = field.decode().split(" ")
+        path = next(fields).decode("utf-8", "surrogateescape")
+        if new_mode in ("100644", "100755") and matches_patterns(path, python_patterns):
+            changed[commit_hash].append((path, blob_hash))
+    return changed
+
+def analyze_commit_stream(repo_path: str, since: datetime, until: datetime, temp_dir: str, training_corpus: str = default_training_corpus, detection_cache: str | None = None) -> list[dict]:
+    """
+    AI verdicts for every commit between since and until, scoring only the Python files the commit
+    adds or modifies, so the cost follows the churn rather than commits x repository size.
+    Files are read straight from the object database (no checkout) and each distinct blob is
+    identified once, with one model trained on training_corpus (training a model per commit would
+    cost a full scan each).
+    Returns [{"date", "commit", "data": [{"file", "blob", "is_ai", "features"}]}], oldest first
+    """
+    if not os.path.exists(temp_dir):
+        os.mkdir(temp_dir)
+    model_store_dir = os.path.join(temp_dir, "models")
+    cache = open_cache(detection_cache)
+    model_key = train_botsniffer(training_corpus, "", model_store_dir, training_corpus, cache)
+    model_path = os.path.join(model_store_dir, f"{model_key}.pkl")
+
+    commits = CommitIndex.load(repo_path).commits_between(since, until)
+    changed = changed_python_files(repo_path, [commit_hash for _, commit_hash in commits])
+    blob_paths = {}
+    for files in changed.values():
+        for path, blob_hash in files:
+            blob_paths.setdefault(blob_hash, path)
+
+    with SnapshotReader(repo_path) as reader:
+        blob_features = features_of_blobs(list(blob_paths), lambda blob_hash: {
+            "name": blob_paths[blob_hash],
+            "content": reader.read(blob_hash).decode("utf-8", "replace")
+        }, cache, "Identifying changed files")
+    if cache is not None:
+        cache.close()
+    verdicts = predict_features({blob_hash: (blob_paths[blob_hash], features) for blob_hash, features in blob_features.items()}, model_path)
+
+    stream = []
+    for timestamp, commit_hash in commits:
+        data = []
+        for path, blob_hash in changed.get(commit_hash, []):
+            if blob_hash in verdicts:
+                data.append({
+                    "file": os.path.join(repo_path, path),
+                    "blob": blob_hash,
+                    "is_ai": verdicts[blob_hash]["is_ai"],
+                    "features": verdicts[blob_hash]["features"]
+                })
+        stream.append({
+            "date": datetime.fromtimestamp(timestamp),
+            "commit": commit_hash,
+            "data": data
+        })
+    return stream
+
+def added_hunks(added_lines: list[tuple[int, str]]) -> list[tuple[int, int, str]]:
+    """
+    (first line, number of lines, dedented code) of every run of consecutive added lines,
+    from a pydriller diff_parsed["added"] list. Runs of only blank lines are left out
+    """
+    runs = []
+    for line_number, line in added_lines:
+        if runs and line_number == runs[-1][0] + len(runs[-1][1]):
+            runs[-1][1].append(line)
+        else:
+            runs.append((line_number, [line]))
+    return [(first_line, len(lines), textwrap.dedent("\n".join(lines)) + "\n")
+            for first_line, lines in runs if any(line.strip() for line in lines)]
+
+def blob_hash_of(content: bytes) -> str:
+    """
+    git's hash of content as a blob, so a fragment and a file with the same code share cache entries
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def analyze_added_hunks(repo_path: str, since: datetime, until: datetime, temp_dir: str, training_corpus: str = default_training_corpus, detection_cache: str | None = None) -> list[dict]:
+    """
+    AI verdicts for the code each commit between since and until adds to Python files, scoring
+    every hunk of added lines (dedented) instead of whole files, so the cost follows the lines
+    added. Hunks that don't parse on their own (e.g. half of a block) can't be scored and are
+    counted in "skipped". One model, trained on training_corpus, scores every hunk.
+    Returns [{"date", "commit", "data": [{"file", "line", "lines", "is_ai", "features"}], "skipped"}],
+    oldest first, like analyze_commit_stream
+    """
+    if not os.path.exists(temp_dir):
+        os.mkdir(temp_dir)
+    model_store_dir = os.path.join(temp_dir, "models")
+    cache = open_cache(detection_cache)
+    model_key = train_botsniffer(training_corpus, "", model_store_dir, training_corpus, cache)
+    model_path = os.path.join(model_store_dir, f"{model_key}.pkl")
+
+    commits = []
+    fragments = {}
+    traversal = Repository(repo_path, since=since, to=until, only_modifications_with_file_types=[".py"])
+    for commit in tqdm(traversal.traverse_commits(), desc="Reading added hunks"):
+        hunks = []
+        for modified_file in commit.modified_files:
+            if modified_file.new_path is None or not modified_file.new_path.endswith(".py"):
+                continue
+            for first_line, num_lines, code in added_hunks(modified_file.diff_parsed["added"]):
+                fragment_hash = blob_hash_of(code.encode())
+                fragments[fragment_hash] = (modified_file.new_path, code)
+                hunks.append((modified_file.new_path, first_line, num_lines, fragment_hash))
+        commits.append((commit.committer_date, commit.hash, hunks))
+    # pydriller doesn't give file modes: keep the hunks of regular files, a symlink named *.py
+    # would be scored on its target path. T covers a symlink turned into a file
+    regular_files = changed_python_files(repo_path, [commit_hash for _, commit_hash, _ in commits], "AMT")
+    for i, (date, commit_hash, hunks) in enumerate(commits):
+        paths = {path for path, _ in regular_files.get(commit_hash, [])}
+        commits[i] = (date, commit_hash, [hunk for hunk in hunks if hunk[0] in paths])
+    fragments = {hunk[3]: fragments[hunk[3]] for _, _, hunks in commits for hunk in hunks}
+
+    fragment_features = features_of_blobs(list(fragments), lambda fragment_hash: {
+        "name": fragments[fragment_hash][0],
+        "content": fragments[fragment_hash][1]
+    }, cache, "Identifying added hunks")
+    if cache is not None:
+        cache.close()
+    verdicts = predict_features({fragment_hash: (fragments[fragment_hash][0], features) for fragment_hash, features in fragment_features.items()}, model_path)
+
+    stream = []
+    for date, commit_hash, hunks in commits:
+        data = []
+        for path, first_line, num_lines, fragment_hash in hunks:
+            if fragment_hash in verdicts:
+                data.append({
+                    "file": os.path.join(repo_path, path),
+                    "line": first_line,
+                    "lines": num_lines,
+                    "is_ai": verdicts[fragment_hash]["is_ai"],
+                    "features": verdicts[fragment_hash]["features"]
+                })
+        stream.append({
+            "date": date,
+            "commit": commit_hash,
+            "data": data,
+            "skipped": len(hunks) - len(data)
+        })
+    return stream
+
+def normalize_whitespace(content: bytes) -> bytes:
+    """
+    content with Unix line endings, no trailing spaces and no blank lines, so copies of a file
+    that only differ in those get the same hash
+    """
+    lines = content.replace(b"\r\n", b"\n").split(b"\n")
+    return b"\n".join(line.rstrip() for line in lines if line.strip()) + b"\n"
+
+def analyze_repos_deduplicated(dates_to_analyze: list[datetime], repo_urls: list[str], root_dir: str, temp_dir: str, training_corpus: str = default_training_corpus, detection_cache: str | None = None, normalize: bool = False, near_duplicate_threshold: float | None = None) -> list[dict]:
+    """
+    analyze_repos_for_ai where every distinct file content, over all repositories and dates, is
+    identified exactly once (vendored files, setup.py boilerplate, files unchanged between dates)
+    and its result given to every path that has it. Files are read from the object database,
+    nothing is checked out. With normalize=True, contents that only differ in line endings,
+    trailing spaces or blank lines count as one: a single one of them is scored, as committed,
+    and its result given to the others. Normalizing only groups them, the cache is keyed by
+    the scored blob like in any other mode.
+    With near_duplicate_threshold (e.g. 0.9), a content whose MinHash similarity to one already
+    scored (or being scored) is at least that high gets its result instead of being identified.
+    The MinHash indexes are saved per snapshot in <temp_dir>/minhash, see near_duplicates.py.
+    A verdict may only be shared when the model is, so one model trained on training_corpus
+    scores everything. The dedup ratio is printed at the end.
+    Returns the same structure as analyze_repos_for_ai
+    """
+    if not os.path.exists(temp_dir):
+        os.mkdir(temp_dir)
+    model_store_dir = os.path.join(temp_dir, "models")
+    cache = open_cache(detection_cache)
+    model_key = train_botsniffer(training_corpus, "", model_store_dir, training_corpus, cache)
+    model_path = os.path.join(model_store_dir, f"{model_key}.pkl")
+
+    ret = []
+    snapshots = []
+    # Where each blob can be read from, and a file name for it
+    blob_sources = {}
+    # MinHash signature of every blob, for near_duplicate_threshold
+    signatures = {}
+    for repo_url in repo_urls:
+        repo_path = dir_from_repo_url(repo_url, root_dir)
+        if not os.path.exists(os.path.join(repo_path, ".git")):
+            continue
+        ret.append({
+            "repository_path": repo_path,
+            "commits": []
+        })
+        index = CommitIndex.load(repo_path)
+        minhash_dir = dir_from_repo_url(repo_url, os.path.join(temp_dir, "minhash"))
+        minhash_index = None
+        for date in dates_to_analyze:
+            commit_hash = getCommitOnDate(date, repo_path, index)
+            if commit_hash is None:
+                ret[-1]["commits"].append({
+                    "date": date,
+                    "commit_hash": "NOT FOUND",
+                    "found_commit": False
+                })
+                continue
+            if near_duplicate_threshold is not None:
+                minhash_index = snapshot_index(repo_path, commit_hash, minhash_dir, minhash_index)
+                signatures.update(minhash_index.signatures)
+            commit = {
+                "date": date,
+                "commit": commit_hash,
+                "data": [],
+                "found_commit": True
+            }
+            ret[-1]["commits"].append(commit)
+            files = [(entry.path, entry.blob_hash) for entry in ls_tree(repo_path, commit_hash, python_patterns)
+                     if entry.mode in ("100644", "100755")]
+            snapshots.append((repo_path, commit, files))
+            for path, blob_hash in files:
+                blob_sources.setdefault(blob_hash, (repo_path, path))
+
+    readers = {}
+    def read_blob(blob_hash: str) -> bytes:
+        repo_path = blob_sources[blob_hash][0]
+        if repo_path not in readers:
+            readers[repo_path] = SnapshotReader(repo_path)
+        return readers[repo_path].read(blob_hash)
+
+    # Blobs that count as one (every blob on its own without normalize), and the one of each
+    # group that is scored for all of them, one the cache already has if there is
+    if normalize:
+        groups = {}
+        for blob_hash in tqdm(blob_sources, desc="Normalizing whitespace"):
+            groups.setdefault(blob_hash_of(normalize_whitespace(read_blob(blob_hash))), []).append(blob_hash)
+    else:
+        groups = {blob_hash: [blob_hash] for blob_hash in blob_sources}
+    cached = set(cache.get_many(list(blob_sources))) if cache is not None else set()
+    representative_of = {}
+    representatives = []
+    for members in groups.values():
+        representative = next((blob_hash for blob_hash in members if blob_hash in cached), members[0])
+        representatives.append(representative)
+        for blob_hash in members:
+            representative_of[blob_hash] = representative
+    num_cached = sum(1 for blob_hash in representatives if blob_hash in cached)
+    missing = [blob_hash for blob_hash in representatives if blob_hash not in cached]
+
+    near_duplicate_of = {}
+    if near_duplicate_threshold is not None:
+        # Only blobs that get a result of their own go in the index
+        scored = MinHashIndex()
+        for blob_hash in representatives:
+            if blob_hash in cached:
+                scored.add(blob_hash, signatures[blob_hash])
+        to_identify = []
+        for blob_hash in missing:
+            matches = scored.query(signatures[blob_hash], near_duplicate_threshold)
+            if matches:
+                near_duplicate_of[blob_hash] = matches[0][0]
+            else:
+                scored.add(blob_hash, signatures[blob_hash])
+                to_identify.append(blob_hash)
+        missing = to_identify
+
+    blob_features = features_of_blobs([blob_hash for blob_hash in representatives if blob_hash not in near_duplicate_of], lambda blob_hash: {
+        "name": blob_sources[blob_hash][1],
+        "content": read_blob(blob_hash).decode("utf-8", "replace")
+    }, cache, "Identifying distinct files")
+    for reader in readers.values():
+        reader.close()
+    if cache is not None:
+        cache.close()
+    verdicts = predict_features({blob_hash: (blob_sources[blob_hash][1], features) for blob_hash, features in blob_features.items()}, model_path)
+    # Never stored in the cache, they are only an approximation
+    for blob_hash, scored_hash in near_duplicate_of.items():
+        if scored_hash in verdicts:
+            verdicts[blob_hash] = verdicts[scored_hash]
+
+    num_files = 0
+    for repo_path, commit, files in snapshots:
+        num_files += len(files)
+        for path, blob_hash in files:
+            if representative_of[blob_hash] in verdicts:
+                commit["data"].append({
+                    "file": os.path.join(repo_path, path),
+                    "is_ai": verdicts[representative_of[blob_hash]]["is_ai"],
+                    "features": verdicts[representative_of[blob_hash]]["features"]
+                })
+
+    unique = len(groups)
+    print(f"{num_files} files over {len(snapshots)} snapshots, {len(blob_sources)} distinct blobs"
+          + (f", {unique} distinct after normalizing whitespace" if normalize else "")
+          + f": dedup ratio {num_files / max(unique, 1):.1f}x, {len(missing)} identified, {num_cached} from the cache"
+          + (f", {len(near_duplicate_of)} from near duplicates" if near_duplicate_threshold is not None else ""))
+    return ret
+
+def process_commit_stream(repo_path: str, stream: list[dict]) -> dict:
+    """
+    analyze_commit_stream or analyze_added_hunks results in the format of process_data (one entry
+    per commit with scored files or hunks), ready for save_data_to_csv
+    """
+    data = [{
+        "repository_path": repo_path,
+        "commits": [dict(commit, found_commit=True) for commit in stream if commit["data"]]
+    }]
+    return process_data(data)[0]
 
 def process_data(data: list[dict]) -> list[dict]:
     """
@@ -236,7 +1181,7 @@ def process_data(data: list[dict]) -> list[dict]:
             "commits": []
         }
         for commits in repository["commits"]:
-            if not commits["found_commit"]:
+            if not commits["found_commit"] or "error" in commits:
                 continue
             commit_dict = {
                 "num_files": 0,
@@ -256,12 +1201,8 @@ def process_data(data: list[dict]) -> list[dict]:
                 if file["is_ai"]:
                     commit_dict["num_files_ai"] += 1
 
-                file["features"] = file["features"].replace("'", '"').replace("np.float64(", "").replace(")","")
-
-                # print(file["features"])
-                features = json.loads(file["features"])
-                for key, val in features.items():
-                    commit_dict["features"][key] += features[key]
+                for key, val in file["features"].items():
+                    commit_dict["features"][key] += val
                 # commit_dict["features"]["comment_quality"] += features["comment_quality"]
                 # commit_dict["features"]["code_indentation"] += features["code_indentation"]
                 # commit_dict["features"]["style_adherence"] += features["style_adherence"]
@@ -338,7 +1279,10 @@ if __name__ == "__main__":
     data = analyze_repos_for_ai(repo_urls= repo_url_links,
                          dates_to_analyze=commit_dates,
                          root_dir=repo_dir,
-                         temp_dir= "temp_files")
+                         temp_dir= "temp_files",
+                         workers=os.cpu_count() or 1,
+                         detection_cache=os.path.join("temp_files", "detections.sqlite"),
+                         checkpoint_file=os.path.join("temp_files", "checkpoint.jsonl"))
 
     processed_data = process_data(data)
     # print(processed_data)
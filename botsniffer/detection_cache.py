@@ -0,0 +1,64 @@
+# Persistent botsniffer features per file content. The five features only depend on the file's
+# blob and the code that extracts them, never on the model, so a blob seen before (at another
+# date, in another repository, or under another model) is never parsed again: any model predicts
+# from its cached features
+import json
+import sqlite3
+
+# SQLite caps the number of parameters of one query
+batch_size = 500
+
+
+class DetectionCache:
+    """
+    (blob hash, feature extractor) -> {feature: value} in an SQLite file. The extractor names the
+    code and version that computed the features (e.g. "features.py 0.1.0").
+    Several processes can share the file, each with its own DetectionCache
+    """
+
+    def __init__(self, db_path: str, extractor: str):
+        self.db_path = db_path
+        self.extractor = extractor
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "blob TEXT, extractor TEXT, features TEXT, "
+            "PRIMARY KEY (blob, extractor)) WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+    def __enter__(self) -> "DetectionCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_many(self, blob_hashes: list[str]) -> dict[str, dict[str, float]]:
+        """
+        {blob hash: features} for the blobs whose features were extracted before
+        """
+        found = {}
+        for i in range(0, len(blob_hashes), batch_size):
+            batch = blob_hashes[i:i + batch_size]
+            rows = self.connection.execute(
+                f"SELECT blob, features FROM features WHERE extractor = ? "
+                f"AND blob IN ({', '.join('?' * len(batch))})",
+                [self.extractor] + batch
+            )
+            for blob_hash, features in rows:
+                found[blob_hash] = json.loads(features)
+        return found
+
+    def put_many(self, results: list[tuple[str, dict[str, float]]]) -> None:
+        """
+        Store (blob hash, features) pairs
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO features VALUES (?, ?, ?)",
+                [(blob_hash, self.extractor, json.dumps(features)) for blob_hash, features in results]
+            )
@@ -0,0 +1,191 @@
+# Long-lived botsniffer detector. It reads one JSON request per line on stdin and writes one JSON
+# response per line on stdout, so the interpreter, the imports and the models are loaded once
+# per run instead of once per botsniffer call.
+#   request:  {"id": any, "model": path of a botsniffer .pkl (optional), "predict": true (optional),
+#              "files": [{"path": ...} or {"name": ..., "content": ...} or {"name": ..., "features": {...}}, ...]}
+#   response: {"id": same, "results": [{"file", "is_ai", "features": {name: float}} or {"file", "error"}, ...]}
+# Files given with their features are only predicted. With "predict": false no model is loaded
+# and the results only hold the features
+# A file that can't be parsed gets an "error" result, the rest of the batch is still identified.
+# Features come from features.py unless the server is started with --botsniffer-features.
+# LocalDetector answers the same requests inside the calling process
+import ast
+import importlib.util
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import tokenize
+
+import features
+
+# The feature vector the botsniffer model is trained on, in its order
+feature_names = ["comment_quality", "code_identation", "style_adherence", "repetitive_patterns", "code_complexity"]
+
+
+def default_model_path() -> str:
+    package_dir = os.path.dirname(importlib.util.find_spec("botsniffer").origin)
+    return os.path.join(package_dir, "data", "botcode.pkl")
+
+
+class Detector:
+    """
+    Feature extraction and botsniffer's prediction, with every model kept in memory and only
+    loaded again when its file changes. With botsniffer_features, features come from botsniffer's
+    own extract_features instead of features.py
+    """
+
+    def __init__(self, botsniffer_features: bool = False):
+        self.extract_features = None
+        self.content_dir = None
+        if botsniffer_features:
+            from botsniffer.feature_extraction.feature_extraction import extract_features
+            self.extract_features = extract_features
+            self.content_dir = tempfile.TemporaryDirectory(prefix="detector_")
+        self.models = {}
+
+    def model(self, model_path: str):
+        stat = os.stat(model_path)
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if model_path not in self.models or self.models[model_path][0] != version:
+            with open(model_path, "rb") as file:
+                self.models[model_path] = (version, pickle.load(file))
+        return self.models[model_path][1]
+
+    def file_features(self, file_path: str) -> dict[str, float]:
+        if self.extract_features is None:
+            return features.extract_file_features(file_path)
+        # Same steps as botsniffer --identify; comment_quality reads the file again by its path
+        with open(file_path) as file:
+            tree = ast.parse(file.read(), type_comments=True)
+        return {name: float(value) for name, value in self.extract_features(file_path, tree).items()}
+
+    def content_features(self, file_name: str, content: str, index: int) -> dict[str, float]:
+        if self.extract_features is None:
+            # Line endings as botsniffer sees them after reading the file in text mode
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+            return features.extract_features(content)
+        # Contents go through a temporary file, since comment_quality only takes a path
+        file_path = os.path.join(self.content_dir.name, f"{index}_{os.path.basename(file_name) or 'file.py'}")
+        with open(file_path, "w") as file:
+            file.write(content)
+        try:
+            return self.file_features(file_path)
+        finally:
+            os.remove(file_path)
+
+    def handle(self, request: dict) -> dict:
+        model = self.model(request.get("model") or default_model_path()) if request.get("predict", True) else None
+        results = []
+        for i, file_request in enumerate(request.get("files", [])):
+            file_name = file_request.get("path") or file_request.get("name", "")
+            try:
+                if "features" in file_request:
+                    file_features = file_request["features"]
+                elif "content" in file_request:
+                    file_features = self.content_features(file_name, file_request["content"], i)
+                else:
+                    file_features = self.file_features(file_name)
+            except (SyntaxError, ValueError, OSError, UnicodeDecodeError, RecursionError, tokenize.TokenError) as e:
+                results.append({"file": file_name, "error": f"{type(e).__name__}: {e}"})
+                continue
+            result = {"file": file_name, "features": file_features}
+            if model is not None:
+                result["is_ai"] = bool(model.predict([[file_features[name] for name in feature_names]])[0])
+            results.append(result)
+        return {"id": request.get("id"), "results": results}
+
+
+def serve(input_stream=sys.stdin, output_stream=sys.stdout, botsniffer_features: bool = False) -> None:
+    detector = Detector(botsniffer_features)
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            response = detector.handle(json.loads(line))
+        except (json.JSONDecodeError, OSError, pickle.UnpicklingError, ValueError) as e:
+            response = {"id": None, "error": f"{type(e).__name__}: {e}"}
+        output_stream.write(json.dumps(response) + "\n")
+        output_stream.flush()
+
+
+class DetectorClient:
+    """
+    Runs detector_server.py as a child process and sends it batches of files
+    """
+
+    def __init__(self, python: str = sys.executable, botsniffer_features: bool = False):
+        self.process = subprocess.Popen(
+            [python, os.path.abspath(__file__)] + (["--botsniffer-features"] if botsniffer_features else []),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        self.next_id = 0
+
+    def __enter__(self) -> "DetectorClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def request(self, files: list[dict], model_path: str | None = None, predict: bool = True) -> list[dict]:
+        self.next_id += 1
+        request = {"id": self.next_id, "model": model_path, "predict": predict, "files": files}
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"detector server exited with code {self.process.wait()}")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"detector server: {response['error']}")
+        return response["results"]
+
+    def identify(self, file_paths: list[str], model_path: str | None = None) -> list[dict]:
+        """
+        Results for files on disk, in the same order
+        """
+        return self.request([{"path": file_path} for file_path in file_paths], model_path)
+
+    def identify_contents(self, contents: list[tuple[str, str]], model_path: str | None = None) -> list[dict]:
+        """
+        Results for (name, source code) pairs, in the same order
+        """
+        return self.request([{"name": name, "content": content} for name, content in contents], model_path)
+
+    def predict(self, named_features: list[tuple[str, dict[str, float]]], model_path: str | None = None) -> list[dict]:
+        """
+        Results for (name, features) pairs whose features were extracted before, in the same order
+        """
+        return self.request([{"name": name, "features": file_features} for name, file_features in named_features], model_path)
+
+
+class LocalDetector(DetectorClient):
+    """
+    DetectorClient without the child process: requests are handled by a Detector in this
+    process, so a pool worker identifies its batches itself
+    """
+
+    def __init__(self, botsniffer_features: bool = False):
+        self.detector = Detector(botsniffer_features)
+        self.next_id = 0
+
+    def close(self) -> None:
+        pass
+
+    def request(self, files: list[dict], model_path: str | None = None, predict: bool = True) -> list[dict]:
+        self.next_id += 1
+        return self.detector.handle({"id": self.next_id, "model": model_path, "predict": predict, "files": files})["results"]
+
+
+if __name__ == "__main__":
+    # Anything printed while identifying must not end up in the responses
+    output_stream = sys.stdout
+    sys.stdout = sys.stderr
+    serve(sys.stdin, output_stream, "--botsniffer-features" in sys.argv[1:])
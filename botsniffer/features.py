@@ -0,0 +1,170 @@
+# The five features botsniffer's model is trained on, computed from one read, one tokenize and one
+# ast.parse of each file, in the current process. Every feature follows botsniffer's own
+# feature_extraction code, which parses the file once per feature and reads it again from its
+# path for comment_quality. `python features.py [folder]` checks the values against botsniffer's
+# on botsniffervalid (or on folder)
+import ast
+import io
+import os
+import statistics
+import sys
+import time
+import tokenize
+
+import radon.complexity as radon_cc
+
+# Comments with one of these words count as high quality (botsniffer is_high_quality_comment)
+high_quality_words = ("TODO", "FIXME", "NOTE", "HACK", "FIX", "DEFINE")
+indentation_size = 4
+
+default_validation_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "botsniffervalid")
+
+
+def comment_quality(source: str) -> float:
+    # botsniffer counts every token, not lines, as a "line"
+    total_tokens = 0
+    total_comments = 0
+    high_quality_comments = 0
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        total_tokens += 1
+        if token.type == tokenize.COMMENT:
+            total_comments += 1
+            if any(word in token.string.upper() for word in high_quality_words):
+                high_quality_comments += 1
+    if high_quality_comments > 0:
+        return high_quality_comments / total_comments + 1
+    if total_comments > 0:
+        return total_comments / total_tokens
+    return 0.0
+
+
+def node_pattern(node: ast.AST, patterns: dict[int, str]) -> str:
+    """
+    botsniffer's get_node_pattern, remembering the pattern of every node already seen by id
+    """
+    pattern = patterns.get(id(node))
+    if pattern is not None:
+        return pattern
+    if isinstance(node, ast.Call):
+        arg_types = [node_pattern(arg, patterns) for arg in node.args]
+        pattern = f"Call:{node_pattern(node.func, patterns)}.{','.join(arg_types)}"
+    elif isinstance(node, ast.Assign):
+        target_names = [node_pattern(target, patterns) for target in node.targets]
+        pattern = f"Assign:{','.join(target_names)}={node_pattern(node.value, patterns)}"
+    elif isinstance(node, ast.Name):
+        pattern = node.id
+    elif isinstance(node, ast.Attribute):
+        pattern = f"{node_pattern(node.value, patterns)}.{node.attr}"
+    else:
+        pattern = node.__class__.__name__
+    patterns[id(node)] = pattern
+    return pattern
+
+
+def indentation_consistency(levels: list[int]) -> float:
+    if len(levels) <= 1:
+        return 1.0
+    median = statistics.median(levels)
+    if median <= 0:
+        return 1.0
+    mad = statistics.median(abs(level - median) for level in levels)
+    return 1.0 - mad / (median * 2)
+
+
+def extract_features(source: str, tree: ast.Module | None = None) -> dict[str, float]:
+    """
+    {feature: value} like botsniffer's extract_features, from the source code (with "\n" line
+    endings, as read from a file opened in text mode) and its tree if already parsed
+    """
+    if tree is None:
+        tree = ast.parse(source, type_comments=True)
+
+    num_nodes = 0
+    indentation_levels = []
+    pattern_counts = {}
+    patterns = {}
+    style_violations = 0
+    for node in ast.walk(tree):
+        num_nodes += 1
+        if isinstance(node, ast.FunctionDef):
+            # Its arguments never match botsniffer's style guide
+            style_violations += 1
+        elif isinstance(node, ast.ClassDef):
+            style_violations += len(node.bases) + len(node.keywords)
+        elif isinstance(node, (ast.Call, ast.Attribute)):
+            style_violations += 1
+        elif isinstance(node, ast.Compare):
+            style_violations += len(node.ops)
+        if not hasattr(node, "lineno"):
+            continue
+        if not isinstance(node, (ast.TypeIgnore, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            indentation_levels.append(node.col_offset // indentation_size)
+        if hasattr(node, "col_offset"):
+            pattern = node_pattern(node, patterns)
+            pattern_counts[pattern] = pattern_counts.get(pattern, 0) + 1
+
+    repeated_patterns = sum(1 for count in pattern_counts.values() if count > 1)
+    return {
+        "comment_quality": comment_quality(source),
+        "code_identation": indentation_consistency(indentation_levels),
+        "style_adherence": 1 - style_violations / num_nodes,
+        "repetitive_patterns": repeated_patterns / num_nodes,
+        "code_complexity": float(sum(block.complexity for block in radon_cc.cc_visit_ast(tree))),
+    }
+
+
+def extract_file_features(file_path: str) -> dict[str, float]:
+    with open(file_path, "r") as file:
+        return extract_features(file.read())
+
+
+def extract_many(file_paths: list[str]) -> list[dict[str, float] | None]:
+    """
+    Features of a batch of files, in the same order. None for a file that can't be read or parsed
+    """
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append(extract_file_features(file_path))
+        except (SyntaxError, ValueError, OSError, UnicodeDecodeError, RecursionError, tokenize.TokenError):
+            results.append(None)
+    return results
+
+
+def validate(folder: str = default_validation_corpus, tolerance: float = 1e-9) -> bool:
+    """
+    Compare these features with botsniffer's on every Python file under folder and print the
+    differences and both timings
+    """
+    from botsniffer.feature_extraction.feature_extraction import extract_features as botsniffer_features
+
+    file_paths = sorted(
+        os.path.join(root, file_name)
+        for root, _, files in os.walk(folder) for file_name in files if file_name.endswith(".py")
+    )
+
+    start = time.perf_counter()
+    expected = []
+    for file_path in file_paths:
+        with open(file_path, "r") as file:
+            tree = ast.parse(file.read(), type_comments=True)
+        expected.append({name: float(value) for name, value in botsniffer_features(file_path, tree).items()})
+    botsniffer_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = extract_many(file_paths)
+    seconds = time.perf_counter() - start
+
+    mismatches = 0
+    for file_path, botsniffer_values, values in zip(file_paths, expected, actual):
+        for name, value in botsniffer_values.items():
+            if values is None or abs(values[name] - value) > tolerance:
+                mismatches += 1
+                print(f"{file_path}: {name} botsniffer {value}, features.py {values and values[name]}")
+    print(f"{len(file_paths)} files, {mismatches} mismatched values. "
+          f"botsniffer {botsniffer_seconds:.2f}s, features.py {seconds:.2f}s")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if validate(*sys.argv[1:2]) else 1)
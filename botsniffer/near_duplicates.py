@@ -0,0 +1,126 @@
+# MinHash signatures of Python files over token shingles, and an LSH index that finds files
+# sharing most of their code (a different license header, a few renamed identifiers) without
+# comparing every pair. One index is kept per snapshot and built from the previous snapshot's,
+# so only new blobs are hashed
+import os
+import re
+import zlib
+
+import numpy as np
+
+import repo_root  # puts the top of the repository on sys.path
+from snapshot_reader import SnapshotReader, ls_tree, python_patterns
+
+num_perm = 64
+# LSH bands of num_perm // bands rows. Two files become candidates when a band matches, which
+# is likely from a similarity of about (1 / bands) ** (bands / num_perm) = 0.5
+bands = 16
+shingle_size = 5
+
+# Hashes are taken mod a prime below 2**31, so a * x + b fits in 64 bits
+prime = (1 << 31) - 1
+# Fixed seed: signatures saved by one run are compared with those of the next
+random_state = np.random.RandomState(20230314)
+perm_a = random_state.randint(1, prime, num_perm).astype(np.uint64)
+perm_b = random_state.randint(0, prime, num_perm).astype(np.uint64)
+
+token_pattern = re.compile(r"\w+|[^\w\s]")
+
+
+def minhash(text: str) -> np.ndarray:
+    """
+    MinHash signature of the shingles (runs of shingle_size tokens) of the code
+    """
+    tokens = token_pattern.findall(text)
+    shingles = {" ".join(tokens[i:i + shingle_size]) for i in range(max(len(tokens) - shingle_size + 1, 1))}
+    hashes = np.array([zlib.crc32(shingle.encode()) % prime for shingle in shingles], dtype=np.uint64)
+    return ((np.outer(hashes, perm_a) + perm_b) % prime).min(axis=0)
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """
+    Estimated Jaccard similarity of the two files' shingles
+    """
+    return float(np.mean(signature == other))
+
+
+class MinHashIndex:
+    """
+    Signatures by key (a blob hash) with LSH buckets to look up near duplicates
+    """
+
+    def __init__(self):
+        self.signatures = {}
+        self.buckets = {}
+
+    @staticmethod
+    def band_keys(signature: np.ndarray) -> list[tuple[int, bytes]]:
+        rows = num_perm // bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+    def add(self, key: str, signature: np.ndarray) -> None:
+        if key in self.signatures:
+            return
+        self.signatures[key] = signature
+        for band_key in self.band_keys(signature):
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in self.band_keys(signature):
+            self.buckets[band_key].discard(key)
+            if not self.buckets[band_key]:
+                del self.buckets[band_key]
+
+    def query(self, signature: np.ndarray, threshold: float) -> list[tuple[str, float]]:
+        """
+        (key, similarity) of the indexed files at least threshold similar, most similar first
+        """
+        candidates = set()
+        for band_key in self.band_keys(signature):
+            candidates |= self.buckets.get(band_key, set())
+        matches = [(key, similarity(signature, self.signatures[key])) for key in candidates]
+        return sorted((match for match in matches if match[1] >= threshold), key=lambda match: -match[1])
+
+    def save(self, file_path: str) -> None:
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        keys = list(self.signatures)
+        matrix = np.array([self.signatures[key] for key in keys], dtype=np.uint64).reshape(len(keys), num_perm)
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(file, keys=np.array(keys, dtype=str), signatures=matrix)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "MinHashIndex":
+        index = cls()
+        with np.load(file_path) as data:
+            for key, signature in zip(data["keys"], data["signatures"]):
+                index.add(str(key), signature)
+        return index
+
+
+def snapshot_index(repo_dir: str, commit_hash: str, index_dir: str, previous: MinHashIndex | None = None) -> MinHashIndex:
+    """
+    Index of the Python blobs of a commit, saved as <index_dir>/<commit>.npz the first time.
+    Signatures already in previous (usually the index of the date before) are reused, so only
+    the blobs new to this snapshot are read and hashed
+    """
+    file_path = os.path.join(index_dir, f"{commit_hash}.npz")
+    if os.path.exists(file_path):
+        return MinHashIndex.load(file_path)
+
+    index = MinHashIndex()
+    entries = ls_tree(repo_dir, commit_hash, python_patterns)
+    with SnapshotReader(repo_dir) as reader:
+        for entry in entries:
+            if entry.mode not in ("100644", "100755"):
+                continue
+            if previous is not None and entry.blob_hash in previous.signatures:
+                index.add(entry.blob_hash, previous.signatures[entry.blob_hash])
+            else:
+                index.add(entry.blob_hash, minhash(reader.read(entry.blob_hash).decode("utf-8", "replace")))
+    index.save(file_path)
+    return index
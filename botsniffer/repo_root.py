@@ -0,0 +1,8 @@
+# Puts the top of the repository on sys.path, where the modules shared with the scripts there
+# live (snapshot_reader.py, commit_index.py, ...). Modules of this folder import it before them
+import os
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repo_root not in sys.path:
+    sys.path.append(repo_root)
@@ -1,11 +1,21 @@
 # able to clone all repos, organized commit by date cloned_commits folder has folders: "2022-11-29", "2023-03-13", "2023-06-25", "2024-03-06"
+import argparse
+import json
 import os
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from urllib.parse import urlparse
+
+from commit_index import CommitIndex
+from snapshot_manifest import build_manifest, is_partial_clone, save_manifest
+from snapshot_store import SnapshotManager, export_archive, materialize_snapshot
 
 # List of GitHub repository URLs
 repo_urls = [
-        "https://github.com/bitcoin/bitcoin", 
+        "https://github.com/bitcoin/bitcoin",
         "https://github.com/google/osv.dev",
         "https://github.com/mitmproxy/mitmproxy",
         "https://github.com/deepspeedai/DeepSpeed",
@@ -51,11 +61,11 @@ repo_urls = [
         "https://github.com/PromtEngineer/localGPT",
         "https://github.com/openai/swarm",
         "https://github.com/GaiZhenbiao/ChuanhuChatGPT",
-    ] 
+    ]
 
 
 # Dates for commits
-# 11/29/22,  right before gpt-4 release 3/13/23, 6/25/23, 3/6/2025 
+# 11/29/22,  right before gpt-4 release 3/13/23, 6/25/23, 3/6/2025
 commit_dates = [
     "2022-11-29",
     "2023-03-13",
@@ -65,63 +75,775 @@ commit_dates = [
 
 # Directory to store cloned commits
 base_dir = "cloned_commits"
-os.makedirs(base_dir, exist_ok=True)
 
-for repo_url in repo_urls:
+# Directory holding one bare mirror per repo URL. It is kept between runs and only
+# fetched again, so adding a date does not re-clone anything. It lives next to base_dir,
+# not inside it, because the analysis scripts treat every folder in base_dir as a date
+mirror_dir = "repo_mirrors"
+
+# How the per-date folders are built:
+#   "copy"     - a full standalone clone of the mirror per date (.git included)
+#   "worktree" - add a detached git worktree of the mirror per date; every date shares the
+#                mirror's objects, so only the checked out files are written
+#   "sparse"   - like "worktree", but the mirror is a blobless partial clone and the worktree
+#                uses a sparse checkout, so only files matching snapshot_patterns are fetched
+#                and written
+#   "hardlink" - plain file tree (no .git) of the files matching snapshot_patterns, every file
+#                hard linked from a store that keeps each distinct content once, so unchanged
+#                files cost nothing on later dates
+#   "archive"  - plain file tree (no .git) of the files matching snapshot_patterns, extracted
+#                from a streamed git archive, for tools that need a folder of files
+snapshot_mode = "worktree"
+
+# Repos known to share history (forks). When one of them is cloned while another one is
+# already mirrored, the new mirror borrows the existing objects (git clone --reference)
+# instead of downloading them again. Groups found by share_objects() are saved in
+# <mirror_dir>/object_groups.json and used the same way on later runs
+related_repos = [
+    ["https://github.com/ytdl-org/youtube-dl", "https://github.com/yt-dlp/yt-dlp"],
+]
+
+# Manifest of every snapshot (blob hash and size of each file, tree hash of each folder),
+# saved as <manifest_dir>/<date>/<owner>/<repo>.json so later stages can diff dates cheaply.
+# In sparse mode only the files matching the snapshot patterns get a size, the other blobs are never fetched
+manifest_dir = "snapshot_manifests"
+
+# Byte budget for the snapshots (plus the hardlink store). None keeps everything; otherwise the
+# least recently used snapshots are deleted at the end of a run and built again by
+# open_snapshot() when they are needed. Last uses are kept in snapshot_access_file
+snapshot_budget_bytes = None
+snapshot_access_file = "snapshot_access.json"
+
+# Use the mirrors as they are, without fetching (analysis nodes with no network, whose mirrors
+# come from bundle-import). Also set by --offline
+offline = False
+
+# Where bundle-export writes and bundle-import reads the git bundles
+bundle_dir = "repo_bundles"
+
+# Timings of the history queries before and after each mirror maintenance, one JSON line per mirror
+maintenance_log = os.path.join(mirror_dir, "maintenance.jsonl")
+
+# Repos cloned/fetched at the same time (network bound) and repos whose snapshots are
+# written at the same time (disk bound)
+fetch_workers = 4
+snapshot_workers = 8
+
+# Content-addressed store used by the hardlink mode. Hard links can't cross filesystems,
+# so it has to be on the same disk as base_dir
+store_dir = "snapshot_store"
+# "hardlink", or "reflink" for copy-on-write clones where the filesystem supports them
+# (btrfs, xfs); files that can't be reflinked are hard linked
+link_mode = "hardlink"
+
+# Files kept by the sparse, hardlink and archive modes. The study only looks at Python files, add any extra
+# gitignore-style patterns (e.g. "requirements*.txt") to extra_snapshot_patterns
+snapshot_patterns = ["*.py"]
+extra_snapshot_patterns = []
+
+
+def repo_owner_and_name(repo_url: str) -> tuple[str, str]:
     repo_name = repo_url.rstrip("/").split("/")[-1]
     repo_owner = repo_url.rstrip("/").split("/")[-2]
-    temp_clone_dir = f"{base_dir}/temp/{repo_owner}/{repo_name}"
+    return repo_owner, repo_name
 
-    if not os.path.exists(temp_clone_dir):
-        # Print debug info
-        print(f"Cloning into: {temp_clone_dir}")
-        os.makedirs(temp_clone_dir, exist_ok=True)  # Ensure directory exists
 
-        # Clone the repo into a temporary directory
-        print(f"Cloning {repo_url} into {temp_clone_dir}...")
-        subprocess.run(["git", "clone", repo_url, temp_clone_dir], check=True)
+def mirror_path(repo_url: str) -> str:
+    """
+    Mirror location for a repo URL: <mirror_dir>/<host>/<path>.git
+    file:// URLs have no host and go under "local"
+    """
+    url = urlparse(repo_url)
+    path = url.path.strip("/")
+    if path.endswith(".git"):
+        path = path[:-len(".git")]
+    return os.path.join(mirror_dir, url.netloc or "local", path + ".git")
 
-    # Ensure the clone actually succeeded
-    if not os.path.exists(temp_clone_dir) or not os.listdir(temp_clone_dir):
-        print(f"Error: {temp_clone_dir} does not exist or is empty after cloning!")
-        continue
 
-    print(f"Successfully cloned into {temp_clone_dir}")
+def snapshot_dir(repo_owner: str, repo_name: str, date: str) -> str:
+    """
+    Folder that holds the repo checked out at a date.
+    cp -r into the already created target_dir put the clone one level down, and
+    avg_churn4.py / bot_analysis2.py walk <date>/<owner>/<repo>/<repo>, so every mode keeps that
+    """
+    return os.path.join(base_dir, date, repo_owner, repo_name, repo_name)
 
-    for date in commit_dates:
-        if not os.path.exists(f"{base_dir}/{date}"):
-            os.makedirs(f"{base_dir}/{date}", exist_ok=True)
 
-        if not os.path.exists(temp_clone_dir) or not os.listdir(temp_clone_dir):
-            print(f"Error: {temp_clone_dir} does not exist or is empty after cloning!")
+def object_groups() -> list[list[str]]:
+    """
+    Groups of repo URLs sharing history: related_repos plus the ones share_objects() found
+    """
+    groups = [list(group) for group in related_repos]
+    groups_file = os.path.join(mirror_dir, "object_groups.json")
+    if os.path.exists(groups_file):
+        with open(groups_file, "r") as file:
+            groups.extend(json.load(file))
+    return groups
+
+
+def fork_families(repo_urls: list[str]) -> list[list[str]]:
+    """
+    repo_urls split into families of repos sharing history (see object_groups), each in the
+    order of repo_urls. Repos related to no other one are families of their own
+    """
+    family_of = {repo_url: [repo_url] for repo_url in repo_urls}
+    for group in object_groups():
+        members = [repo_url for repo_url in repo_urls if repo_url in group]
+        for repo_url in members[1:]:
+            first, other = family_of[members[0]], family_of[repo_url]
+            if first is not other:
+                first.extend(other)
+                for member in other:
+                    family_of[member] = first
+    families = {id(family): family for family in family_of.values()}
+    return [sorted(family, key=repo_urls.index) for family in families.values()]
+
+
+def reference_mirror(repo_url: str) -> str | None:
+    """
+    An existing mirror of a repo that shares history with repo_url, if there is one.
+    The mirror must be complete: snapshot_all fetches a fork family in a single job, so no
+    mirror of the family is still being cloned while another one is
+    """
+    for group in object_groups():
+        if repo_url not in group:
             continue
+        for other_url in group:
+            if other_url != repo_url and os.path.exists(mirror_path(other_url)):
+                return mirror_path(other_url)
+    return None
+
+
+# Refs a mirror keeps. A plain --mirror would also fetch GitHub's refs/pull/*/head and
+# refs/pull/*/merge, tens of thousands of refs (and unmerged objects) on big repos
+mirror_refspecs = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+
+def use_mirror_refspecs(repo_mirror_dir: str) -> None:
+    """
+    Make origin fetch only mirror_refspecs, and drop refs/pull/* left by an older --mirror clone
+    """
+    subprocess.run(["git", "config", "--unset-all", "remote.origin.fetch"], cwd=repo_mirror_dir)
+    for refspec in mirror_refspecs:
+        subprocess.run(["git", "config", "--add", "remote.origin.fetch", refspec], cwd=repo_mirror_dir, check=True)
+    pull_refs = subprocess.run(
+        ["git", "for-each-ref", "--format=delete %(refname)", "refs/pull/"],
+        cwd=repo_mirror_dir, capture_output=True, text=True, check=True
+    ).stdout
+    if pull_refs:
+        subprocess.run(["git", "update-ref", "--stdin"], cwd=repo_mirror_dir, input=pull_refs, text=True, check=True)
+
+
+def update_mirror(repo_url: str, repo_mirror_dir: str, blob_filter: str | None = None) -> bool:
+    """
+    Create a bare mirror of repo_url's branches and tags the first time, afterwards only fetch
+    what is new.
+    blob_filter (e.g. "blob:none") makes a partial clone when the mirror is created; git fetches
+    the missing blobs on demand when they are checked out.
+    A new mirror of a repo related to an already mirrored one borrows that mirror's objects.
+    Returns False if the mirror is missing or empty afterwards
+    """
+    if not os.path.exists(repo_mirror_dir):
+        print(f"Cloning {repo_url} into {repo_mirror_dir}...")
+        os.makedirs(os.path.dirname(repo_mirror_dir), exist_ok=True)
+        args = ["git", "clone", "--bare", repo_url, repo_mirror_dir]
+        if blob_filter:
+            args.insert(3, f"--filter={blob_filter}")
+        reference = reference_mirror(repo_url)
+        if reference:
+            print(f"Borrowing objects of {reference}")
+            args[3:3] = ["--reference-if-able", os.path.abspath(reference)]
+        subprocess.run(args, check=True)
+        use_mirror_refspecs(repo_mirror_dir)
+    else:
+        print(f"Fetching {repo_url} into {repo_mirror_dir}...")
+        use_mirror_refspecs(repo_mirror_dir)
+        subprocess.run(["git", "remote", "update", "--prune"], cwd=repo_mirror_dir, check=True)
+
+    # Ensure the clone actually succeeded
+    if not os.path.exists(repo_mirror_dir) or not os.listdir(repo_mirror_dir):
+        print(f"Error: {repo_mirror_dir} does not exist or is empty after cloning!")
+        return False
+
+    return True
 
-        # Use absolute paths instead of changing directories with os.chdir
-        commit_hash = subprocess.check_output(
-            ["git", "rev-list", "-n", "1", "--before", date, "HEAD"],
-            cwd=temp_clone_dir  # Specify the working directory here
-        ).decode().strip()
 
+def copy_snapshot(repo_mirror_dir: str, commit_hash: str, target_dir: str) -> None:
+    """
+    Standalone clone of the mirror in target_dir, .git included, checked out at the commit
+    """
+    if not os.path.exists(os.path.join(target_dir, ".git")):
+        os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+        subprocess.run(["git", "clone", "--no-checkout", os.path.abspath(repo_mirror_dir), target_dir], check=True)
+    subprocess.run(["git", "checkout", "--force", "--detach", commit_hash], cwd=target_dir, check=True)
+
+
+def worktree_snapshot(repo_mirror_dir: str, commit_hash: str, target_dir: str) -> None:
+    """
+    Checkout the commit into target_dir as a detached worktree of the mirror.
+    Objects stay in the mirror, target_dir only gets the files and a .git pointer file
+    """
+    if os.path.exists(os.path.join(target_dir, ".git")):
+        # Snapshot left by an earlier run, just move it to the commit
+        subprocess.run(["git", "checkout", "--force", "--detach", commit_hash], cwd=target_dir, check=True)
+        return
+
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    # Forget worktrees whose folders were deleted by hand, otherwise git refuses to reuse the path
+    subprocess.run(["git", "worktree", "prune"], cwd=repo_mirror_dir, check=True)
+    subprocess.run(
+        ["git", "worktree", "add", "--force", "--detach", os.path.abspath(target_dir), commit_hash],
+        cwd=repo_mirror_dir,
+        check=True
+    )
+
+
+def sparse_snapshot(repo_mirror_dir: str, commit_hash: str, target_dir: str) -> None:
+    """
+    Detached worktree of the mirror that only checks out files matching the snapshot patterns.
+    With a blobless mirror, only the blobs of those files are downloaded
+    """
+    if not os.path.exists(os.path.join(target_dir, ".git")):
+        os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+        subprocess.run(["git", "worktree", "prune"], cwd=repo_mirror_dir, check=True)
+        # Add the worktree without writing any file, then restrict it before the first checkout
+        subprocess.run(
+            ["git", "worktree", "add", "--no-checkout", "--detach", os.path.abspath(target_dir), commit_hash],
+            cwd=repo_mirror_dir,
+            check=True
+        )
+        subprocess.run(
+            ["git", "sparse-checkout", "set", "--no-cone"] + snapshot_patterns + extra_snapshot_patterns,
+            cwd=target_dir,
+            check=True
+        )
+    subprocess.run(["git", "checkout", "--force", "--detach", commit_hash], cwd=target_dir, check=True)
+
+
+def hardlink_snapshot(repo_mirror_dir: str, commit_hash: str, target_dir: str) -> None:
+    """
+    Plain file tree of the matching files in target_dir, linked from the content-addressed store
+    """
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    num_files, new_blobs = materialize_snapshot(
+        repo_mirror_dir, commit_hash, target_dir, store_dir,
+        snapshot_patterns + extra_snapshot_patterns, link_mode
+    )
+    print(f"{target_dir}: {num_files} files, {new_blobs} new in {store_dir}")
+
+
+def archive_snapshot(repo_mirror_dir: str, commit_hash: str, target_dir: str) -> None:
+    """
+    Plain file tree of the matching files in target_dir, extracted from git archive
+    """
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    num_files = export_archive(repo_mirror_dir, commit_hash, target_dir, snapshot_patterns + extra_snapshot_patterns)
+    print(f"{target_dir}: {num_files} files")
+
+
+snapshot_functions = {
+    "copy": copy_snapshot,
+    "worktree": worktree_snapshot,
+    "sparse": sparse_snapshot,
+    "hardlink": hardlink_snapshot,
+    "archive": archive_snapshot,
+}
+
+# Partial clone filter used when a mirror is first created for a mode
+mirror_filters = {
+    "sparse": "blob:none",
+}
+
+
+def snapshot_dates(repo_url: str, dates: list[str], mode: str = snapshot_mode) -> int:
+    """
+    Write the snapshot of every date from the repo's mirror, one date after the other.
+    Returns the number of snapshots written
+    """
+    repo_owner, repo_name = repo_owner_and_name(repo_url)
+    repo_mirror_dir = mirror_path(repo_url)
+    take_snapshot = snapshot_functions[mode]
+
+    # One git log pass per repo (cached in the mirror), then every date is a binary search
+    # A mirror's HEAD is the default branch
+    index = CommitIndex.load(repo_mirror_dir, "HEAD")
+    count = 0
+    for date in dates:
+        commit_hash = index.commit_before(date)
         if commit_hash:
-            target_dir = f"{base_dir}/{date}/{repo_owner}/{repo_name}"
-            os.makedirs(target_dir, exist_ok=True)
+            take_snapshot(repo_mirror_dir, commit_hash, snapshot_dir(repo_owner, repo_name, date))
+            save_manifest(
+                build_manifest(repo_mirror_dir, commit_hash, snapshot_patterns + extra_snapshot_patterns),
+                os.path.join(manifest_dir, date, repo_owner, f"{repo_name}.json")
+            )
+            snapshot_manager().touch(repo_owner, repo_name, date)
+            count += 1
+    return count
+
+
+# (owner, name) -> URL of every repo snapshotted or opened by this process
+snapshot_urls = {}
+
+
+def repo_url_of(repo_owner: str, repo_name: str) -> str:
+    if (repo_owner, repo_name) in snapshot_urls:
+        return snapshot_urls[(repo_owner, repo_name)]
+    for repo_url in repo_urls:
+        if repo_owner_and_name(repo_url) == (repo_owner, repo_name):
+            return repo_url
+    return f"https://github.com/{repo_owner}/{repo_name}"
+
+
+def materialize_date(repo_owner: str, repo_name: str, date: str) -> None:
+    """
+    Build one snapshot again (after it was evicted), fetching the mirror only if it is missing
+    """
+    repo_url = repo_url_of(repo_owner, repo_name)
+    if not os.path.exists(mirror_path(repo_url)):
+        update_mirror(repo_url, mirror_path(repo_url), mirror_filters.get(snapshot_mode))
+    if not snapshot_dates(repo_url, [date], snapshot_mode):
+        raise FileNotFoundError(f"{repo_url} has no commit before {date}")
+
+
+manager = None
+manager_lock = threading.Lock()
+
+
+def snapshot_manager() -> SnapshotManager:
+    global manager
+    with manager_lock:
+        if manager is None:
+            manager = SnapshotManager(
+                snapshot_access_file, snapshot_budget_bytes, snapshot_dir, materialize_date,
+                store_dir if snapshot_mode == "hardlink" else None
+            )
+    return manager
+
+
+def open_snapshot(repo_url: str, date: str) -> str:
+    """
+    Folder of the repo at a date, built again if it was evicted to stay under the budget
+    """
+    repo_owner, repo_name = repo_owner_and_name(repo_url)
+    snapshot_urls[(repo_owner, repo_name)] = repo_url
+    return snapshot_manager().open(repo_owner, repo_name, date)
+
 
-            # Instead of cloning again, just checkout the commit in the target directory
-            subprocess.run(["git", "checkout", commit_hash], cwd=temp_clone_dir, check=True)
+def snapshot_repo(repo_url: str, dates: list[str], mode: str = snapshot_mode) -> None:
+    if update_mirror(repo_url, mirror_path(repo_url), mirror_filters.get(mode)):
+        snapshot_dates(repo_url, dates, mode)
 
-            # Now copy the necessary files to target_dir (if needed)
-            # subprocess.run(["cp", "-r", temp_clone_dir, target_dir], check=True)
+
+def fetch_job(repo_url: str, mode: str) -> float:
+    start = time.perf_counter()
+    if offline:
+        if not os.path.exists(mirror_path(repo_url)):
+            raise RuntimeError(f"no mirror of {repo_url} and fetching is disabled (offline)")
+        return time.perf_counter() - start
+    if not update_mirror(repo_url, mirror_path(repo_url), mirror_filters.get(mode)):
+        raise RuntimeError(f"mirror of {repo_url} is missing or empty")
+    return time.perf_counter() - start
+
+
+def fetch_family_job(family: list[str], mode: str) -> dict[str, float | Exception]:
+    """
+    fetch_job for every repo of a fork family, one after the other, so a new mirror only ever
+    borrows objects from mirrors that are complete.
+    Returns {repo_url: fetch seconds, or the exception it failed with}
+    """
+    results = {}
+    for repo_url in family:
+        try:
+            results[repo_url] = fetch_job(repo_url, mode)
+        except Exception as e:
+            results[repo_url] = e
+    return results
+
+
+def snapshot_job(repo_url: str, dates: list[str], mode: str) -> tuple[int, float]:
+    start = time.perf_counter()
+    count = snapshot_dates(repo_url, dates, mode)
+    return count, time.perf_counter() - start
+
+
+def snapshot_all(
+    repo_urls: list[str],
+    dates: list[str],
+    mode: str = snapshot_mode,
+    fetch_workers: int = fetch_workers,
+    snapshot_workers: int = snapshot_workers
+) -> dict[str, dict]:
+    """
+    Fetch the mirrors and write the snapshots of many repos at once.
+    Fetches (network bound) and snapshots (disk bound) have their own pool, a repo's snapshots
+    start as soon as its fork family's fetch is done. Repos sharing history are fetched one
+    after the other by a single job (see fork_families), so a mirror borrowing another one's
+    objects never borrows from one still being cloned. The dates of one repo are written by a
+    single job so two jobs never write to the same mirror. A failing repo is recorded in the
+    report and the others carry on.
+    Returns {repo_url: {"fetch_seconds", "snapshot_seconds", "snapshots", "error"}}
+    """
+    report = {
+        repo_url: {"fetch_seconds": 0.0, "snapshot_seconds": 0.0, "snapshots": 0, "error": None}
+        for repo_url in repo_urls
+    }
+    with ThreadPoolExecutor(fetch_workers) as fetch_pool, ThreadPoolExecutor(snapshot_workers) as snapshot_pool:
+        fetches = [fetch_pool.submit(fetch_family_job, family, mode) for family in fork_families(repo_urls)]
+        snapshots = {}
+        for future in as_completed(fetches):
+            for repo_url, result in future.result().items():
+                if isinstance(result, Exception):
+                    print(f"Error fetching {repo_url}: {result}")
+                    report[repo_url]["error"] = f"fetch: {result}"
+                    continue
+                report[repo_url]["fetch_seconds"] = result
+                snapshots[snapshot_pool.submit(snapshot_job, repo_url, dates, mode)] = repo_url
+
+        for future in as_completed(snapshots):
+            repo_url = snapshots[future]
             try:
-                subprocess.run(["cp", "-r", temp_clone_dir, target_dir], check=True)
-            except subprocess.CalledProcessError as e:
-                print(f"Error during copy: {e}")
-                print("Some files or directories may be missing.")  
+                report[repo_url]["snapshots"], report[repo_url]["snapshot_seconds"] = future.result()
+            except Exception as e:
+                print(f"Error taking snapshots of {repo_url}: {e}")
+                report[repo_url]["error"] = f"snapshot: {e}"
+    return report
+
+
+def export_bundles(repo_urls: list[str], bundle_dir: str) -> None:
+    """
+    Pack every mirror into git bundles under <bundle_dir>/<mirror path>/0001.bundle, 0002.bundle, ...
+    The commits already exported are remembered in a "tips" file next to the bundles, so each
+    new bundle only holds the history added since the previous export. Copy bundle_dir to the
+    offline node and run bundle-import there.
+    Blobless (partial) mirrors are skipped, a bundle has to carry every object
+    """
+    for repo_url in repo_urls:
+        repo_mirror_dir = mirror_path(repo_url)
+        if not os.path.exists(repo_mirror_dir):
+            print(f"Skipping {repo_url}: no mirror")
+            continue
+        if is_partial_clone(repo_mirror_dir):
+            print(f"Skipping {repo_url}: partial clone mirrors can't be bundled")
+            continue
+
+        repo_bundle_dir = os.path.join(bundle_dir, os.path.relpath(repo_mirror_dir, mirror_dir))
+        os.makedirs(repo_bundle_dir, exist_ok=True)
+        tips_file = os.path.join(repo_bundle_dir, "tips")
+        exported = set()
+        if os.path.exists(tips_file):
+            with open(tips_file, "r") as file:
+                exported = set(file.read().split())
+
+        refs = subprocess.check_output(
+            ["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads/", "refs/tags/"], cwd=repo_mirror_dir
+        ).decode().split("\n")
+        refs = [ref.split(" ", 1) for ref in refs if ref]
+        tips = {object_name for object_name, _ in refs}
+        if tips <= exported:
+            print(f"{repo_url}: nothing new to bundle")
+            continue
+
+        bundle_number = len([name for name in os.listdir(repo_bundle_dir) if name.endswith(".bundle")]) + 1
+        bundle_path = os.path.join(repo_bundle_dir, f"{bundle_number:04d}.bundle")
+        revisions = ["HEAD"] + [refname for _, refname in refs] + [f"^{tip}" for tip in sorted(exported)]
+        result = subprocess.run(
+            ["git", "bundle", "create", os.path.abspath(bundle_path), "--stdin"],
+            cwd=repo_mirror_dir, input="\n".join(revisions).encode(), capture_output=True
+        )
+        if result.returncode != 0:
+            if b"empty bundle" in result.stderr:
+                # Only refs moved to commits that were already exported
+                print(f"{repo_url}: nothing new to bundle")
+                continue
+            raise RuntimeError(f"git bundle create failed for {repo_url}: {result.stderr.decode().strip()}")
+
+        with open(tips_file, "a") as file:
+            file.write("\n".join(sorted(tips - exported)) + "\n")
+        print(f"{repo_url}: {bundle_path} ({os.path.getsize(bundle_path) / 2**20:.1f} MiB)")
+
+
+def import_bundles(repo_urls: list[str], bundle_dir: str) -> None:
+    """
+    Restore the mirrors from the bundles written by export_bundles, applying every bundle not
+    imported yet in order. The mirrors end up where the rest of the script expects them, with
+    origin pointing at the real URL, so snapshots work with --offline
+    """
+    for repo_url in repo_urls:
+        repo_mirror_dir = mirror_path(repo_url)
+        repo_bundle_dir = os.path.join(bundle_dir, os.path.relpath(repo_mirror_dir, mirror_dir))
+        if not os.path.isdir(repo_bundle_dir):
+            print(f"Skipping {repo_url}: no bundles")
+            continue
+        bundles = sorted(name for name in os.listdir(repo_bundle_dir) if name.endswith(".bundle"))
+
+        imported_file = os.path.join(repo_mirror_dir, "imported-bundles")
+        imported = set()
+        if os.path.exists(imported_file):
+            with open(imported_file, "r") as file:
+                imported = set(file.read().split())
+
+        for name in bundles:
+            if name in imported:
+                continue
+            bundle_path = os.path.abspath(os.path.join(repo_bundle_dir, name))
+            if not os.path.exists(repo_mirror_dir):
+                os.makedirs(os.path.dirname(repo_mirror_dir), exist_ok=True)
+                subprocess.run(["git", "clone", "--bare", bundle_path, repo_mirror_dir], check=True)
+                subprocess.run(["git", "remote", "set-url", "origin", repo_url], cwd=repo_mirror_dir, check=True)
+                use_mirror_refspecs(repo_mirror_dir)
+            else:
+                subprocess.run(["git", "fetch", bundle_path] + mirror_refspecs, cwd=repo_mirror_dir, check=True)
+            with open(imported_file, "a") as file:
+                file.write(name + "\n")
+            print(f"{repo_url}: imported {name}")
+
+
+def history_queries(repo_mirror_dir: str) -> dict[str, list[str]]:
+    """
+    The kind of history walks the analysis scripts do (Pydriller traversals, date lookups,
+    per-file logs), used to time a mirror before and after maintenance. Blobless mirrors get
+    --name-only instead of --numstat, which would fetch every missing blob to count lines
+    """
+    middle_date = commit_dates[len(commit_dates) // 2]
+    stats = "--name-only" if is_partial_clone(repo_mirror_dir) else "--numstat"
+    queries = {
+        "count": ["git", "rev-list", "--count", "HEAD"],
+        "before_date": ["git", "rev-list", "-n", "1", f"--before={middle_date}", "HEAD"],
+        "log_with_stats": ["git", "log", "-n", "200", "--format=%H", stats, "HEAD"],
+    }
+    # The last changed Python file at HEAD, a path limited log is what Bloom filters speed up
+    changed = subprocess.check_output(
+        ["git", "log", "-n", "1", "--format=", "--name-only", "HEAD", "--", "*.py"], cwd=repo_mirror_dir
+    ).decode().split("\n")
+    if changed[0]:
+        queries["path_log"] = ["git", "log", "--format=%H", "HEAD", "--", changed[0]]
+    return queries
+
+
+def time_queries(repo_mirror_dir: str, queries: dict[str, list[str]]) -> dict[str, float]:
+    timings = {}
+    for name, args in queries.items():
+        start = time.perf_counter()
+        subprocess.run(args, cwd=repo_mirror_dir, capture_output=True, check=True)
+        timings[name] = round(time.perf_counter() - start, 4)
+    return timings
+
+
+def count_objects(repo_mirror_dir: str) -> dict[str, int]:
+    output = subprocess.check_output(["git", "count-objects", "-v"], cwd=repo_mirror_dir).decode()
+    fields = dict(line.split(": ", 1) for line in output.splitlines())
+    return {"loose": int(fields["count"]), "packs": int(fields["packs"])}
 
 
-    # Cleanup temporary clone after processing
-    subprocess.run(["rm", "-rf", temp_clone_dir], check=True)
+def maintain_mirror(repo_url: str) -> dict:
+    """
+    Pack loose objects and roll small packs into bigger ones (geometric repack, so the big
+    packs are not rewritten every time) behind a multi-pack index, then write a commit-graph
+    with changed-path Bloom filters. Blobless mirrors get a plain repack: git can't do a geometric
+    one on a partial clone. Returns the object counts and query timings before and after
+    """
+    repo_mirror_dir = mirror_path(repo_url)
+    queries = history_queries(repo_mirror_dir)
+    before = time_queries(repo_mirror_dir, queries)
+    objects_before = count_objects(repo_mirror_dir)
 
+    start = time.perf_counter()
+    repack = ["git", "repack", "-d", "-q", "--write-midx"]
+    if not is_partial_clone(repo_mirror_dir):
+        repack.insert(4, "--geometric=2")
+    subprocess.run(repack, cwd=repo_mirror_dir, check=True)
+    subprocess.run(
+        ["git", "commit-graph", "write", "--reachable", "--changed-paths", "--split", "--no-progress"],
+        cwd=repo_mirror_dir, check=True
+    )
+    # Later fetches keep the commit-graph up to date, Bloom filters are read by default
+    subprocess.run(["git", "config", "fetch.writeCommitGraph", "true"], cwd=repo_mirror_dir, check=True)
+    maintenance_seconds = time.perf_counter() - start
 
+    after = time_queries(repo_mirror_dir, queries)
+    return {
+        "repo": repo_url,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "maintenance_seconds": round(maintenance_seconds, 2),
+        "objects_before": objects_before,
+        "objects_after": count_objects(repo_mirror_dir),
+        "queries_before": before,
+        "queries_after": after,
+    }
 
 
+def maintain_mirrors(repo_urls: list[str]) -> list[dict]:
+    """
+    Maintenance of every existing mirror, appended to maintenance_log
+    """
+    results = []
+    for repo_url in repo_urls:
+        if not os.path.exists(mirror_path(repo_url)):
+            continue
+        try:
+            result = maintain_mirror(repo_url)
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"Error maintaining {repo_url}: {e}")
+            continue
+        results.append(result)
+        with open(maintenance_log, "a") as file:
+            file.write(json.dumps(result) + "\n")
+    return results
+
+
+def print_maintenance_report(results: list[dict]) -> None:
+    print("\n--- Mirror maintenance ---")
+    for result in results:
+        before = sum(result["queries_before"].values())
+        after = sum(result["queries_after"].values())
+        print(
+            f"{result['repo']}: {result['objects_before']['loose']} loose objects and "
+            f"{result['objects_before']['packs']} packs -> {result['objects_after']['loose']} and "
+            f"{result['objects_after']['packs']}, history queries {before:.2f}s -> {after:.2f}s "
+            f"(maintenance {result['maintenance_seconds']:.1f}s)"
+        )
+
+
+def objects_size(repo_mirror_dir: str) -> int:
+    """
+    Bytes used by the mirror's own objects (borrowed ones are not counted)
+    """
+    total = 0
+    for root, _, files in os.walk(os.path.join(repo_mirror_dir, "objects")):
+        for file_name in files:
+            total += os.path.getsize(os.path.join(root, file_name))
+    return total
+
+
+def root_commits(repo_mirror_dir: str) -> set[str]:
+    return set(subprocess.check_output(
+        ["git", "rev-list", "--max-parents=0", "--all"], cwd=repo_mirror_dir
+    ).decode().split())
+
+
+def share_objects(repo_urls: list[str]) -> list[dict]:
+    """
+    Group the mirrored repos that share a root commit, and make every other member of a group
+    borrow the first member's objects through objects/info/alternates. Objects the first
+    member already has are then dropped from the others (git repack -a -d -l).
+    The first member gets gc.pruneExpire=never: objects it stops referencing may still be
+    needed by the others, so it must never delete them.
+    Returns one entry per group: {"repos", "bytes_before", "bytes_after", "bytes_saved"}
+    """
+    mirrored = [repo_url for repo_url in repo_urls if os.path.exists(mirror_path(repo_url))]
+    roots = {repo_url: root_commits(mirror_path(repo_url)) for repo_url in mirrored}
+
+    # Union-find over the repos, joined by the root commits they have in common
+    parent = {repo_url: repo_url for repo_url in mirrored}
+
+    def find(repo_url: str) -> str:
+        while parent[repo_url] != repo_url:
+            parent[repo_url] = parent[parent[repo_url]]
+            repo_url = parent[repo_url]
+        return repo_url
+
+    owner_of_root = {}
+    for repo_url in mirrored:
+        for root in roots[repo_url]:
+            if root in owner_of_root:
+                parent[find(repo_url)] = find(owner_of_root[root])
+            else:
+                owner_of_root[root] = repo_url
+
+    groups = {}
+    for repo_url in mirrored:
+        groups.setdefault(find(repo_url), []).append(repo_url)
+    groups = [group for group in groups.values() if len(group) > 1]
+
+    report = []
+    for group in groups:
+        shared_mirror = mirror_path(group[0])
+        shared_objects = os.path.abspath(os.path.join(shared_mirror, "objects"))
+        subprocess.run(["git", "config", "gc.pruneExpire", "never"], cwd=shared_mirror, check=True)
+
+        bytes_before = sum(objects_size(mirror_path(repo_url)) for repo_url in group)
+        for repo_url in group[1:]:
+            repo_mirror_dir = mirror_path(repo_url)
+            alternates_file = os.path.join(repo_mirror_dir, "objects", "info", "alternates")
+            alternates = []
+            if os.path.exists(alternates_file):
+                with open(alternates_file, "r") as file:
+                    alternates = file.read().split()
+            if shared_objects in alternates:
+                continue
+            os.makedirs(os.path.dirname(alternates_file), exist_ok=True)
+            with open(alternates_file, "a") as file:
+                file.write(shared_objects + "\n")
+            subprocess.run(["git", "repack", "-a", "-d", "-l", "-q"], cwd=repo_mirror_dir, check=True)
+        bytes_after = sum(objects_size(mirror_path(repo_url)) for repo_url in group)
+
+        report.append({
+            "repos": group,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_saved": bytes_before - bytes_after
+        })
+
+    os.makedirs(mirror_dir, exist_ok=True)
+    with open(os.path.join(mirror_dir, "object_groups.json"), "w") as file:
+        json.dump(groups, file, indent=2)
+    return report
+
+
+def print_share_report(report: list[dict]) -> None:
+    print("\n--- Shared objects ---")
+    for group in report:
+        print(f"{', '.join(group['repos'])}: {group['bytes_before'] / 2**20:.1f} MiB -> "
+              f"{group['bytes_after'] / 2**20:.1f} MiB ({group['bytes_saved'] / 2**20:.1f} MiB saved)")
+    if not report:
+        print("No mirrored repositories share history")
+
+
+def print_report(report: dict[str, dict], wall_seconds: float) -> None:
+    failed = [repo_url for repo_url, result in report.items() if result["error"]]
+    print(f"\n--- Snapshot summary ({wall_seconds:.1f}s wall clock) ---")
+    for repo_url, result in report.items():
+        status = "FAILED" if result["error"] else "ok"
+        print(f"{status:6} {repo_url}: {result['snapshots']} snapshots, "
+              f"fetch {result['fetch_seconds']:.1f}s, snapshot {result['snapshot_seconds']:.1f}s"
+              + (f", {result['error']}" if result["error"] else ""))
+    print(f"{len(report) - len(failed)} repositories ok, {len(failed)} failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror the analyzed repositories and snapshot them by date")
+    parser.add_argument(
+        "command", nargs="?", default="snapshot", choices=["snapshot", "maintain", "bundle-export", "bundle-import"],
+        help="snapshot (default): fetch and write the date folders; "
+             "maintain: repack the mirrors and write their commit-graphs; "
+             "bundle-export/bundle-import: move the mirrors to a node without network"
+    )
+    parser.add_argument("--bundle-dir", default=bundle_dir, help="Folder of the git bundles")
+    parser.add_argument("--offline", action="store_true", help="Snapshot from the mirrors without fetching")
+    args = parser.parse_args()
+
+    if args.command == "maintain":
+        print_maintenance_report(maintain_mirrors(repo_urls))
+        raise SystemExit(0)
+    if args.command == "bundle-export":
+        export_bundles(repo_urls, args.bundle_dir)
+        raise SystemExit(0)
+    if args.command == "bundle-import":
+        import_bundles(repo_urls, args.bundle_dir)
+        raise SystemExit(0)
+
+    offline = offline or args.offline
+    os.makedirs(base_dir, exist_ok=True)
+    for date in commit_dates:
+        os.makedirs(os.path.join(base_dir, date), exist_ok=True)
+
+    start = time.perf_counter()
+    report = snapshot_all(repo_urls, commit_dates)
+    print_report(report, time.perf_counter() - start)
+    print_share_report(share_objects(repo_urls))
+    print_maintenance_report(maintain_mirrors(repo_urls))
 
+    evicted = snapshot_manager().enforce_budget()
+    if evicted:
+        print(f"Evicted {len(evicted)} least recently used snapshots to stay under the budget")
+    print(f"Snapshot footprint: {snapshot_manager().footprint() / 2**20:.1f} MiB")
@@ -0,0 +1,151 @@
+# Per-repo index of (commit timestamp, commit hash) sorted by time, so any number of
+# dates can be turned into commits with a binary search instead of a git/pydriller walk each
+import os
+import subprocess
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+# Stored in the repo's (common) git directory, next to the objects it describes
+index_file_name = "commit-date-index"
+
+
+def to_timestamp(date: datetime | str) -> int:
+    """
+    Unix timestamp for a datetime or a "YYYY-MM-DD" string.
+    Naive datetimes and plain dates are local time, like git and pydriller read them. A plain
+    date is local midnight at the start of that day, whereas git --before=YYYY-MM-DD takes the
+    current time of day on that date
+    """
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return int(date.timestamp())
+
+
+def git_common_dir(repo_path: str) -> str:
+    """
+    The .git directory shared by a clone, a bare mirror and all of their worktrees
+    """
+    common_dir = subprocess.check_output(
+        ["git", "rev-parse", "--git-common-dir"], cwd=repo_path
+    ).decode().strip()
+    return os.path.join(repo_path, common_dir)
+
+
+def default_rev(repo_path: str) -> str:
+    """
+    History to index: the remote's default branch if the clone knows it (HEAD may be
+    left detached on an old commit by a checkout), otherwise HEAD
+    """
+    result = subprocess.run(
+        ["git", "rev-parse", "--verify", "-q", "refs/remotes/origin/HEAD"],
+        cwd=repo_path, capture_output=True
+    )
+    return "refs/remotes/origin/HEAD" if result.returncode == 0 else "HEAD"
+
+
+class CommitIndex:
+    """
+    Commits reachable from one tip, as parallel arrays of committer timestamps (sorted)
+    and raw hashes
+    """
+
+    def __init__(self, tip: str, timestamps: array, hashes: bytes):
+        self.tip = tip
+        self.timestamps = timestamps
+        self.hashes = hashes
+        self.hash_size = len(tip) // 2
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def commit_at(self, i: int) -> str:
+        return self.hashes[i * self.hash_size:(i + 1) * self.hash_size].hex()
+
+    def commit_before(self, date: datetime | str) -> str | None:
+        """
+        Latest commit made at or before date, like git rev-list -n 1 --before date, except that a
+        plain "YYYY-MM-DD" cuts off at local midnight (see to_timestamp)
+        """
+        i = bisect_right(self.timestamps, to_timestamp(date)) - 1
+        return self.commit_at(i) if i >= 0 else None
+
+    def commit_after(self, date: datetime | str, until: datetime | str | None = None) -> str | None:
+        """
+        First commit made at or after date (and at or before until, if given),
+        same as the first commit of a pydriller Repository(since=date, to=until) traversal
+        """
+        i = bisect_left(self.timestamps, to_timestamp(date))
+        if i >= len(self.timestamps):
+            return None
+        if until is not None and self.timestamps[i] > to_timestamp(until):
+            return None
+        return self.commit_at(i)
+
+    def commits_between(self, since: datetime | str, until: datetime | str) -> list[tuple[int, str]]:
+        """
+        (timestamp, hash) of every commit made between since and until (both included), oldest first
+        """
+        start = bisect_left(self.timestamps, to_timestamp(since))
+        end = bisect_right(self.timestamps, to_timestamp(until))
+        return [(self.timestamps[i], self.commit_at(i)) for i in range(start, end)]
+
+    @classmethod
+    def build(cls, repo_path: str, rev: str = "HEAD") -> "CommitIndex":
+        """
+        Index the history of rev with a single git log pass
+        """
+        output = subprocess.check_output(["git", "log", "--format=%ct %H", rev], cwd=repo_path).decode()
+        commits = []
+        for line in output.splitlines():
+            timestamp, commit_hash = line.split(" ", 1)
+            commits.append((int(timestamp), commit_hash))
+        # git log lists newest first; reversed first, commits with the same timestamp stay oldest first
+        commits.reverse()
+        commits.sort(key=lambda commit: commit[0])
+
+        tip = subprocess.check_output(["git", "rev-parse", rev], cwd=repo_path).decode().strip()
+        timestamps = array("q", (timestamp for timestamp, _ in commits))
+        hashes = b"".join(bytes.fromhex(commit_hash) for _, commit_hash in commits)
+        return cls(tip, timestamps, hashes)
+
+    def save(self, file_path: str) -> None:
+        """
+        Layout: tip hash, newline, the timestamps as int64, then the raw hashes
+        """
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(self.tip.encode() + b"\n")
+            file.write(self.timestamps.tobytes())
+            file.write(self.hashes)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def read(cls, file_path: str) -> "CommitIndex":
+        with open(file_path, "rb") as file:
+            tip = file.readline().decode().strip()
+            data = file.read()
+        hash_size = len(tip) // 2
+        count = len(data) // (8 + hash_size)
+        timestamps = array("q")
+        timestamps.frombytes(data[:count * 8])
+        return cls(tip, timestamps, data[count * 8:])
+
+    @classmethod
+    def load(cls, repo_path: str, rev: str | None = None) -> "CommitIndex":
+        """
+        Cached index for a repo. It is rebuilt only when the tip of rev moved since it was saved
+        """
+        if rev is None:
+            rev = default_rev(repo_path)
+        tip = subprocess.check_output(["git", "rev-parse", rev], cwd=repo_path).decode().strip()
+        file_path = os.path.join(git_common_dir(repo_path), index_file_name)
+
+        if os.path.exists(file_path):
+            index = cls.read(file_path)
+            if index.tip == tip:
+                return index
+
+        index = cls.build(repo_path, tip)
+        index.save(file_path)
+        return index
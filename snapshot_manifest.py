@@ -0,0 +1,136 @@
+# Manifest of a snapshot: every file's (blob hash, size) and every folder's tree hash, from one
+# git ls-tree pass. Two manifests can be diffed without reading any file, and a folder whose
+# tree hash did not change is skipped as a whole
+import json
+import os
+import subprocess
+
+from snapshot_reader import matches_patterns, python_patterns
+
+
+def is_partial_clone(repo_dir: str) -> bool:
+    promisor = subprocess.run(
+        ["git", "config", "remote.origin.promisor"], cwd=repo_dir, capture_output=True, text=True
+    ).stdout.strip()
+    return promisor == "true"
+
+
+def blob_sizes(repo_dir: str, blob_hashes: list[str]) -> dict[str, int]:
+    """
+    {blob hash: size} from one git cat-file --batch-check
+    """
+    if not blob_hashes:
+        return {}
+    output = subprocess.run(
+        ["git", "cat-file", "--batch-check=%(objectname) %(objectsize)"],
+        cwd=repo_dir, input="\n".join(blob_hashes) + "\n", capture_output=True, text=True, check=True
+    ).stdout
+    sizes = {}
+    for line in output.splitlines():
+        object_hash, size = line.split()[:2]
+        if size.isdigit():
+            sizes[object_hash] = int(size)
+    return sizes
+
+
+def build_manifest(repo_dir: str, commit_hash: str, size_patterns: list[str] | None = python_patterns) -> dict:
+    """
+    {"commit", "tree": root tree hash, "files": {path: [blob hash, size]}, "trees": {folder: tree hash}}
+    In a partial clone (the sparse mode's blobless mirror) only the blobs matching size_patterns,
+    which the snapshot already fetched, get a size, the others get None: git ls-tree -l would
+    fetch every missing blob, one at a time, just to report its size
+    """
+    partial = is_partial_clone(repo_dir)
+    args = ["git", "ls-tree", "-r", "-t", "-z", commit_hash]
+    if not partial:
+        args.insert(5, "-l")
+    output = subprocess.check_output(args, cwd=repo_dir)
+    root_tree = subprocess.check_output(["git", "rev-parse", f"{commit_hash}^{{tree}}"], cwd=repo_dir).decode().strip()
+    commit_hash = subprocess.check_output(["git", "rev-parse", f"{commit_hash}^{{commit}}"], cwd=repo_dir).decode().strip()
+
+    files = {}
+    trees = {}
+    for record in output.split(b"\0"):
+        if not record:
+            continue
+        info, path = record.split(b"\t", 1)
+        mode, object_type, object_hash, *size = info.decode().split()
+        path = path.decode("utf-8", "surrogateescape")
+        if object_type == "tree":
+            trees[path] = object_hash
+        elif object_type == "blob":
+            files[path] = [object_hash, int(size[0]) if size else None]
+
+    if partial:
+        sizes = blob_sizes(repo_dir, sorted({
+            object_hash for path, (object_hash, _) in files.items() if matches_patterns(path, size_patterns)
+        }))
+        for entry in files.values():
+            entry[1] = sizes.get(entry[0])
+    return {"commit": commit_hash, "tree": root_tree, "files": files, "trees": trees}
+
+
+def save_manifest(manifest: dict, file_path: str) -> None:
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, file_path)
+
+
+def load_manifest(file_path: str) -> dict:
+    with open(file_path, "r") as file:
+        return json.load(file)
+
+
+def cached_manifest(repo_dir: str, commit_hash: str, manifest_dir: str) -> dict:
+    """
+    Manifest of a commit, stored as <manifest_dir>/<commit>.json the first time it is built
+    """
+    file_path = os.path.join(manifest_dir, f"{commit_hash}.json")
+    if os.path.exists(file_path):
+        return load_manifest(file_path)
+    manifest = build_manifest(repo_dir, commit_hash)
+    save_manifest(manifest, file_path)
+    return manifest
+
+
+def diff_manifests(old: dict | None, new: dict, patterns: list[str] | None = python_patterns) -> dict:
+    """
+    Files of new (matching patterns) that have to be processed again compared to old.
+    Returns {"changed": added or modified paths, "deleted": paths only in old,
+             "unchanged": paths whose content is the same, "skipped_trees": top folders not looked into}
+    """
+    old_files = old["files"] if old else {}
+    if old and old["tree"] == new["tree"]:
+        unchanged_trees = {""}
+    else:
+        old_trees = old["trees"] if old else {}
+        unchanged_trees = {folder for folder, tree_hash in new["trees"].items() if old_trees.get(folder) == tree_hash}
+
+    def in_unchanged_tree(path: str) -> bool:
+        if "" in unchanged_trees:
+            return True
+        folder = path
+        while "/" in folder:
+            folder = folder.rsplit("/", 1)[0]
+            if folder in unchanged_trees:
+                return True
+        return False
+
+    changed, unchanged = [], []
+    for path, (blob_hash, _) in new["files"].items():
+        if not matches_patterns(path, patterns):
+            continue
+        # Inside an unchanged folder there is nothing to compare
+        if in_unchanged_tree(path) or (path in old_files and old_files[path][0] == blob_hash):
+            unchanged.append(path)
+        else:
+            changed.append(path)
+
+    deleted = [path for path in old_files if path not in new["files"] and matches_patterns(path, patterns)]
+    skipped_trees = sorted(
+        folder for folder in unchanged_trees
+        if folder == "" or not in_unchanged_tree(folder)
+    )
+    return {"changed": changed, "deleted": deleted, "unchanged": unchanged, "skipped_trees": skipped_trees}
@@ -0,0 +1,233 @@
+# Read the files of any commit straight from the git object database: no checkout, copy or
+# reset. Blobs go through one long-lived git cat-file --batch process per repository
+import os
+import subprocess
+import tarfile
+from fnmatch import fnmatch
+from typing import Iterator, NamedTuple
+
+
+# What the study analyzes
+python_patterns = ["*.py"]
+
+
+class TreeEntry(NamedTuple):
+    mode: str
+    blob_hash: str
+    size: int
+    path: str
+
+
+def matches_patterns(path: str, patterns: list[str] | None) -> bool:
+    """
+    gitignore-like matching: a pattern without a "/" is matched against the file name,
+    anything else against the whole path. None matches everything
+    """
+    if patterns is None:
+        return True
+    name = path.rsplit("/", 1)[-1]
+    for pattern in patterns:
+        if fnmatch(path if "/" in pattern else name, pattern):
+            return True
+    return False
+
+
+def ls_tree(repo_dir: str, treeish: str, patterns: list[str] | None = None, recursive: bool = True) -> list[TreeEntry]:
+    """
+    Entries of a tree (a commit, or "<commit>:<dir>"). Recursive listings only hold blobs that
+    match the patterns, submodules are left out since their content is in another repository
+    """
+    args = ["git", "ls-tree", "-z", "-l", treeish]
+    if recursive:
+        args.insert(2, "-r")
+    output = subprocess.check_output(args, cwd=repo_dir)
+    entries = []
+    for record in output.split(b"\0"):
+        if not record:
+            continue
+        info, path = record.split(b"\t", 1)
+        mode, object_type, object_hash, size = info.decode().split()
+        path = path.decode("utf-8", "surrogateescape")
+        if recursive and (object_type != "blob" or not matches_patterns(path, patterns)):
+            continue
+        entries.append(TreeEntry(mode, object_hash, int(size) if size != "-" else 0, path))
+    return entries
+
+
+# git archive leaves out export-ignore paths and rewrites $Format:...$ in export-subst files,
+# the snapshot must hold the commit's files as they are
+raw_export_attributes = "* -export-ignore -export-subst"
+
+
+def keep_export_attributes_off(repo_dir: str) -> None:
+    """
+    Add raw_export_attributes to the repository's info/attributes, which takes precedence
+    over every .gitattributes of the tree
+    """
+    attributes_path = subprocess.check_output(
+        ["git", "rev-parse", "--path-format=absolute", "--git-path", "info/attributes"], cwd=repo_dir, text=True
+    ).strip()
+    content = ""
+    if os.path.exists(attributes_path):
+        with open(attributes_path) as file:
+            content = file.read()
+    if raw_export_attributes not in content.splitlines():
+        os.makedirs(os.path.dirname(attributes_path), exist_ok=True)
+        with open(attributes_path, "a") as file:
+            if content and not content.endswith("\n"):
+                file.write("\n")
+            file.write(raw_export_attributes + "\n")
+
+
+def archive_stream(repo_dir: str, commit_hash: str, patterns: list[str] = python_patterns) -> tuple[tarfile.TarFile, subprocess.Popen] | None:
+    """
+    git archive of the files matching the patterns (as git pathspecs, "*.py" matches in every
+    folder), opened as a streaming tar, with the git process to pass to finish_archive once it
+    is read. export-ignore and export-subst attributes are not applied.
+    Returns None when no file matches
+    """
+    keep_export_attributes_off(repo_dir)
+    process = subprocess.Popen(
+        ["git", "archive", "--format=tar", commit_hash, "--"] + patterns,
+        cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        return tarfile.open(fileobj=process.stdout, mode="r|"), process
+    except tarfile.ReadError:
+        stderr = process.stderr.read().decode()
+        process.wait()
+        if "did not match any files" in stderr:
+            return None
+        raise RuntimeError(f"git archive {commit_hash} failed in {repo_dir}: {stderr.strip()}")
+
+
+def finish_archive(process: subprocess.Popen, repo_dir: str, commit_hash: str) -> None:
+    """
+    Wait for the git archive of archive_stream. Raises RuntimeError if it failed, since the
+    tar read so far may then be cut short
+    """
+    stderr = process.stderr.read().decode()
+    if process.wait() != 0:
+        raise RuntimeError(f"git archive {commit_hash} failed in {repo_dir}: {stderr.strip()}")
+
+
+def iter_archive(repo_dir: str, commit_hash: str, patterns: list[str] = python_patterns) -> Iterator[tuple[str, bytes]]:
+    """
+    (path, content) of every matching file, streamed out of git archive without writing anything
+    """
+    stream = archive_stream(repo_dir, commit_hash, patterns)
+    if stream is None:
+        return
+    tar, process = stream
+    with tar:
+        for member in tar:
+            if member.isfile():
+                yield member.name, tar.extractfile(member).read()
+    finish_archive(process, repo_dir, commit_hash)
+
+
+class SnapshotReader:
+    """
+    Lists and reads files of any commit of one repository (a clone, bare mirror or worktree)
+    """
+
+    def __init__(self, repo_dir: str):
+        self.repo_dir = repo_dir
+        self.process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=repo_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def read(self, object_name: str) -> bytes:
+        """
+        Content of a blob, given its hash or "<commit>:<path>"
+        """
+        self.process.stdin.write(object_name.encode() + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode().split()
+        if len(header) != 3:
+            raise KeyError(f"{object_name} not found in {self.repo_dir}")
+        content = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)  # newline after the content
+        return content
+
+    def files(self, commit_hash: str, patterns: list[str] | None = python_patterns) -> list[TreeEntry]:
+        return ls_tree(self.repo_dir, commit_hash, patterns)
+
+    def iter_files(self, commit_hash: str, patterns: list[str] | None = python_patterns) -> Iterator[tuple[str, bytes]]:
+        """
+        (path, content) of every matching file in the commit
+        """
+        for entry in self.files(commit_hash, patterns):
+            yield entry.path, self.read(entry.blob_hash)
+
+    def tree(self, commit_hash: str) -> "CommitTree":
+        return CommitTree(self, commit_hash)
+
+
+class CommitTree:
+    """
+    os-like view of one commit (listdir, exists, isfile, isdir, read_text), for code that walks
+    folders. Paths are relative to the repository root
+    """
+
+    def __init__(self, reader: SnapshotReader, commit_hash: str):
+        self.reader = reader
+        self.commit_hash = commit_hash
+        self.dirs = {}
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        path = os.path.normpath(path).strip("/")
+        return "" if path == "." else path
+
+    def entries(self, path: str) -> dict[str, TreeEntry]:
+        path = self.normalize(path)
+        if path not in self.dirs:
+            treeish = f"{self.commit_hash}:{path}" if path else self.commit_hash
+            self.dirs[path] = {entry.path: entry for entry in ls_tree(self.reader.repo_dir, treeish, recursive=False)}
+        return self.dirs[path]
+
+    def entry(self, path: str) -> TreeEntry | None:
+        path = self.normalize(path)
+        if not path:
+            return None
+        parent, _, name = path.rpartition("/")
+        if parent and not self.isdir(parent):
+            return None
+        return self.entries(parent).get(name)
+
+    def listdir(self, path: str = "") -> list[str]:
+        if not self.isdir(path):
+            raise NotADirectoryError(path)
+        return list(self.entries(path))
+
+    def exists(self, path: str) -> bool:
+        return self.normalize(path) == "" or self.entry(path) is not None
+
+    def isdir(self, path: str) -> bool:
+        if self.normalize(path) == "":
+            return True
+        entry = self.entry(path)
+        return entry is not None and entry.mode == "040000"
+
+    def isfile(self, path: str) -> bool:
+        entry = self.entry(path)
+        return entry is not None and entry.mode in ("100644", "100755")
+
+    def read_text(self, path: str, encoding: str = "utf-8") -> str:
+        entry = self.entry(path)
+        if entry is None or not self.isfile(path):
+            raise FileNotFoundError(path)
+        return self.reader.read(entry.blob_hash).decode(encoding)
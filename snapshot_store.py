@@ -0,0 +1,382 @@
+# Content-addressed store for snapshot files. Every file content is written once, keyed by
+# its git blob hash, and the date folders are built out of hard links (or reflinks) to it,
+# so a new date only costs the files that changed since the dates already in the store
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Callable
+
+from snapshot_reader import SnapshotReader, archive_stream, finish_archive, ls_tree
+
+# ioctl that makes dst share src's data blocks (copy-on-write), on btrfs/xfs
+FICLONE = 0x40049409
+
+# Folder of the store holding which store files each snapshot uses. Link counts can't tell,
+# a reflinked copy is a file of its own
+refs_dir_name = "refs"
+
+
+def store_path(store_dir: str, blob_hash: str, mode: str) -> str:
+    # Hard links share permissions, so executable files are stored apart from the others
+    suffix = ".x" if mode == "100755" else ""
+    return os.path.join(store_dir, blob_hash[:2], blob_hash[2:] + suffix)
+
+
+def add_to_store(store_dir: str, reader: SnapshotReader, blob_hash: str, mode: str) -> str:
+    """
+    Write the blob into the store unless it is already there. Returns its path in the store
+    """
+    path = store_path(store_dir, blob_hash, mode)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A temp file of its own: other snapshot threads may be writing the same blob
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(reader.read(blob_hash))
+            # Read only, editing a hard linked file would change it in every date at once
+            os.chmod(temp_path, 0o555 if mode == "100755" else 0o444)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            # Another writer got the same content there first
+            if not os.path.exists(path):
+                raise
+    return path
+
+
+def link_file(src: str, dst: str, link_mode: str = "hardlink") -> None:
+    """
+    Put src at dst as a reflink (falling back to a hard link if the filesystem can't) or a hard link
+    """
+    if link_mode == "reflink":
+        try:
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            shutil.copymode(src, dst)
+            os.chmod(dst, os.stat(dst).st_mode | 0o200)
+            return
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+    os.link(src, dst)
+
+
+def materialize_snapshot(
+    repo_dir: str,
+    commit_hash: str,
+    target_dir: str,
+    store_dir: str,
+    patterns: list[str] | None = None,
+    link_mode: str = "hardlink"
+) -> tuple[int, int]:
+    """
+    Build target_dir as a plain file tree (no .git) of the commit, linking every file from the store.
+    The tree is built next to target_dir and swapped in at the end, so a rerun never leaves a mix
+    of two commits behind. The store files it uses are recorded in the store (see write_snapshot_refs).
+    Returns (files linked, blobs newly written to the store)
+    """
+    entries = ls_tree(repo_dir, commit_hash, patterns)
+    # Recorded first, so garbage collection never deletes what the snapshot is being built from
+    write_snapshot_refs(store_dir, target_dir, {
+        os.path.relpath(store_path(store_dir, blob_hash, mode), store_dir): size
+        for mode, blob_hash, size, _ in entries if mode != "120000"
+    })
+    build_dir = make_build_dir(target_dir)
+
+    new_blobs = 0
+    with SnapshotReader(repo_dir) as reader:
+        for mode, blob_hash, _, path in entries:
+            dst = os.path.join(build_dir, path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if mode == "120000":
+                os.symlink(reader.read(blob_hash), dst)
+                continue
+            if not os.path.exists(store_path(store_dir, blob_hash, mode)):
+                new_blobs += 1
+            link_file(add_to_store(store_dir, reader, blob_hash, mode), dst, link_mode)
+
+    swap_in(build_dir, target_dir)
+    return len(entries), new_blobs
+
+
+def make_build_dir(target_dir: str) -> str:
+    """
+    New empty folder next to target_dir, unique to the calling thread, to build it in
+    """
+    parent_dir = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=parent_dir, prefix=f"{os.path.basename(target_dir)}.", suffix=".tmp")
+    # mkdtemp makes it private to the owner, the snapshot is not
+    os.chmod(build_dir, 0o755)
+    return build_dir
+
+
+def swap_in(build_dir: str, target_dir: str) -> None:
+    """
+    Replace target_dir (if any) with the freshly built build_dir
+    """
+    if os.path.exists(target_dir):
+        old_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(target_dir)),
+                                   prefix=f"{os.path.basename(target_dir)}.", suffix=".old")
+        os.rmdir(old_dir)
+        os.rename(target_dir, old_dir)
+        os.rename(build_dir, target_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(build_dir, target_dir)
+
+
+def export_archive(repo_dir: str, commit_hash: str, target_dir: str, patterns: list[str]) -> int:
+    """
+    Plain file tree (no .git) of the files matching the patterns, extracted straight from a
+    git archive stream: nothing is checked out or copied. Files marked export-ignore or
+    export-subst are exported as committed (see archive_stream).
+    Raises RuntimeError if git archive fails, leaving target_dir as it was.
+    Returns the number of files written
+    """
+    build_dir = make_build_dir(target_dir)
+    try:
+        num_files = 0
+        stream = archive_stream(repo_dir, commit_hash, patterns)
+        if stream is not None:
+            tar, process = stream
+            with tar:
+                for member in tar:
+                    # "data" filter: no absolute paths, links out of the tree or special files
+                    if hasattr(tarfile, "data_filter"):
+                        tar.extract(member, build_dir, filter="data")
+                    else:
+                        tar.extract(member, build_dir)
+                    num_files += member.isfile()
+            finish_archive(process, repo_dir, commit_hash)
+    except Exception:
+        shutil.rmtree(build_dir)
+        raise
+
+    swap_in(build_dir, target_dir)
+    return num_files
+
+
+def snapshot_refs_path(store_dir: str, target_dir: str) -> str:
+    key = hashlib.sha1(os.path.abspath(target_dir).encode()).hexdigest()
+    return os.path.join(store_dir, refs_dir_name, key + ".json")
+
+
+def write_snapshot_refs(store_dir: str, target_dir: str, files: dict[str, int]) -> None:
+    """
+    Record that the snapshot at target_dir uses these store files ({path in the store: size}),
+    replacing what it used before
+    """
+    refs_path = snapshot_refs_path(store_dir, target_dir)
+    os.makedirs(os.path.dirname(refs_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(refs_path), suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump({"snapshot": os.path.abspath(target_dir), "files": files}, file)
+    os.replace(temp_path, refs_path)
+
+
+def release_snapshot(store_dir: str, target_dir: str) -> None:
+    """
+    Forget the store files of a deleted snapshot, for the next garbage collection
+    """
+    refs_path = snapshot_refs_path(store_dir, target_dir)
+    if os.path.exists(refs_path):
+        os.remove(refs_path)
+
+
+def store_references(store_dir: str) -> dict[str, dict[str, int]]:
+    """
+    {snapshot path: {path in the store: size}} of every snapshot built from the store
+    """
+    references = {}
+    refs_dir = os.path.join(store_dir, refs_dir_name)
+    if os.path.isdir(refs_dir):
+        for file_name in os.listdir(refs_dir):
+            if file_name.endswith(".json"):
+                with open(os.path.join(refs_dir, file_name), "r") as file:
+                    refs = json.load(file)
+                references[refs["snapshot"]] = refs["files"]
+    return references
+
+
+def store_files(store_dir: str) -> dict[str, int]:
+    """
+    {path in the store: size} of every stored content, files still being written left out
+    """
+    files = {}
+    for root, dir_names, file_names in os.walk(store_dir):
+        if root == store_dir and refs_dir_name in dir_names:
+            dir_names.remove(refs_dir_name)
+        for file_name in file_names:
+            if not file_name.endswith(".tmp"):
+                path = os.path.join(root, file_name)
+                files[os.path.relpath(path, store_dir)] = os.lstat(path).st_size
+    return files
+
+
+def collect_store_garbage(store_dir: str) -> int:
+    """
+    Delete store files no snapshot uses anymore (see write_snapshot_refs).
+    Returns the bytes freed
+    """
+    referenced = set()
+    for files in store_references(store_dir).values():
+        referenced.update(files)
+    freed = 0
+    for path, size in store_files(store_dir).items():
+        if path not in referenced:
+            os.remove(os.path.join(store_dir, path))
+            freed += size
+    return freed
+
+
+def disk_usage(paths: list[str]) -> int:
+    """
+    Bytes of all files under the paths, hard linked files counted once
+    """
+    seen = set()
+    total = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for file_name in files:
+                stat = os.lstat(os.path.join(root, file_name))
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_size
+    return total
+
+
+class SnapshotManager:
+    """
+    Keeps the (owner, repo, date) snapshots under a byte budget. Every use of a snapshot is
+    recorded in state_file; when the footprint is over the budget, the least recently used
+    snapshots are deleted. open() builds a deleted snapshot again, so callers never see the
+    difference (apart from the time it takes).
+    snapshot_path(owner, repo, date) gives a snapshot's folder and materialize(owner, repo, date)
+    builds it
+    """
+
+    def __init__(
+        self,
+        state_file: str,
+        budget_bytes: int | None,
+        snapshot_path: Callable[[str, str, str], str],
+        materialize: Callable[[str, str, str], None],
+        store_dir: str | None = None
+    ):
+        self.state_file = state_file
+        self.budget_bytes = budget_bytes
+        self.snapshot_path = snapshot_path
+        self.materialize = materialize
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self.last_access = {}
+        if os.path.exists(state_file):
+            with open(state_file, "r") as file:
+                self.last_access = json.load(file)
+
+    @staticmethod
+    def key(owner: str, repo: str, date: str) -> str:
+        return f"{owner}/{repo}/{date}"
+
+    def save(self) -> None:
+        temp_path = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.last_access, file, indent=1)
+        os.replace(temp_path, self.state_file)
+
+    def touch(self, owner: str, repo: str, date: str) -> None:
+        with self.lock:
+            self.last_access[self.key(owner, repo, date)] = time.time()
+            self.save()
+
+    def open(self, owner: str, repo: str, date: str) -> str:
+        """
+        Path of the snapshot, built again first if it was evicted
+        """
+        path = self.snapshot_path(owner, repo, date)
+        if not os.path.exists(path):
+            self.materialize(owner, repo, date)
+        self.touch(owner, repo, date)
+        self.enforce_budget(keep={self.key(owner, repo, date)})
+        return path
+
+    def snapshot_usage(self) -> dict[str, tuple[int, dict[str, int]]]:
+        """
+        {key: (bytes of its own, {store file: size})} of every tracked snapshot. Files linked or
+        reflinked from the store are counted with the store, not with the snapshot
+        """
+        references = store_references(self.store_dir) if self.store_dir else {}
+        usage = {}
+        for key in self.last_access:
+            path = os.path.abspath(self.snapshot_path(*key.split("/")))
+            if path in references:
+                usage[key] = (0, references[path])
+            else:
+                usage[key] = (disk_usage([path]) if os.path.exists(path) else 0, {})
+        return usage
+
+    def footprint(self, usage: dict[str, tuple[int, dict[str, int]]] | None = None) -> int:
+        """
+        Bytes used by the tracked snapshots and the content store, each store file counted once
+        """
+        if usage is None:
+            usage = self.snapshot_usage()
+        footprint = sum(own_bytes for own_bytes, _ in usage.values())
+        if self.store_dir and os.path.exists(self.store_dir):
+            footprint += sum(store_files(self.store_dir).values())
+        return footprint
+
+    def evict(self, owner: str, repo: str, date: str) -> None:
+        path = self.snapshot_path(owner, repo, date)
+        if os.path.exists(path):
+            # Worktrees left behind in a mirror are cleaned by the next git worktree prune
+            shutil.rmtree(path)
+        if self.store_dir:
+            release_snapshot(self.store_dir, path)
+        with self.lock:
+            self.last_access.pop(self.key(owner, repo, date), None)
+            self.save()
+
+    def enforce_budget(self, keep: set[str] = set()) -> list[str]:
+        """
+        Evict least recently used snapshots (never the ones in keep) until the footprint fits
+        the budget. Sizes are measured once: each eviction subtracts the snapshot's own bytes
+        and the store files no other snapshot uses, which are deleted.
+        Returns the evicted keys
+        """
+        if self.budget_bytes is None:
+            return []
+        usage = self.snapshot_usage()
+        footprint = self.footprint(usage)
+        if footprint > self.budget_bytes and self.store_dir:
+            footprint -= collect_store_garbage(self.store_dir)
+        users = Counter()
+        if self.store_dir:
+            for files in store_references(self.store_dir).values():
+                users.update(list(files))
+        evicted = []
+        for key in sorted(usage, key=lambda key: self.last_access.get(key, 0)):
+            if footprint <= self.budget_bytes:
+                break
+            if key in keep:
+                continue
+            own_bytes, files = usage[key]
+            self.evict(*key.split("/"))
+            footprint -= own_bytes
+            for path, size in files.items():
+                users[path] -= 1
+                if users[path] == 0 and os.path.exists(os.path.join(self.store_dir, path)):
+                    os.remove(os.path.join(self.store_dir, path))
+                    footprint -= size
+            evicted.append(key)
+        return evicted
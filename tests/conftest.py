@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def git(repo_dir: str, *args: str) -> str:
+    return subprocess.run(["git", *args], cwd=repo_dir, check=True, capture_output=True, text=True).stdout
+
+
+def commit(repo_dir: str, files: dict[str, str], date: str) -> str:
+    """
+    Write the files and commit them at date (YYYY-MM-DD). Returns the commit hash
+    """
+    for path, content in files.items():
+        file_path = os.path.join(repo_dir, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as file:
+            file.write(content)
+    git(repo_dir, "add", "-A")
+    env = dict(os.environ, GIT_AUTHOR_DATE=f"{date}T12:00:00", GIT_COMMITTER_DATE=f"{date}T12:00:00")
+    subprocess.run(["git", "commit", "-q", "-m", f"commit of {date}"], cwd=repo_dir, env=env, check=True)
+    return git(repo_dir, "rev-parse", "HEAD").strip()
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    monkeypatch.setenv("GIT_AUTHOR_NAME", "Test")
+    monkeypatch.setenv("GIT_AUTHOR_EMAIL", "test@example.com")
+    monkeypatch.setenv("GIT_COMMITTER_NAME", "Test")
+    monkeypatch.setenv("GIT_COMMITTER_EMAIL", "test@example.com")
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", os.devnull)
+
+
+@pytest.fixture
+def source_repo(tmp_path) -> str:
+    """
+    Upstream repository at tmp_path/upstream/owner/project: two dated commits on main, a tag,
+    and a GitHub-like refs/pull/1/head pointing at a commit no branch has
+    """
+    repo_dir = str(tmp_path / "upstream" / "owner" / "project")
+    os.makedirs(repo_dir)
+    git(repo_dir, "init", "-q", "-b", "main")
+    # Lets sparse mode make a blobless clone over file://
+    git(repo_dir, "config", "uploadpack.allowFilter", "true")
+    commit(repo_dir, {"app.py": "print('v1')\n", "pkg/util.py": "X = 1\n", "README.md": "v1\n"}, "2022-01-10")
+    git(repo_dir, "tag", "v1")
+    commit(repo_dir, {"app.py": "print('v2')\n", "pkg/new.py": "Y = 2\n"}, "2022-06-10")
+    git(repo_dir, "checkout", "-q", "-b", "pull-request")
+    pull_commit = commit(repo_dir, {"app.py": "print('pr')\n"}, "2022-07-01")
+    git(repo_dir, "checkout", "-q", "main")
+    git(repo_dir, "branch", "-q", "-D", "pull-request")
+    git(repo_dir, "update-ref", "refs/pull/1/head", pull_commit)
+    return repo_dir
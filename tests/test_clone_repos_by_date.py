@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+import clone_repos_by_date
+from conftest import commit, git
+
+dates = ["2022-03-01", "2022-09-01"]
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    Runs in an empty folder, where the script's relative mirror, snapshot and store folders go
+    """
+    os.makedirs(tmp_path / "work")
+    monkeypatch.chdir(tmp_path / "work")
+    monkeypatch.setattr(clone_repos_by_date, "manager", None)
+    monkeypatch.setattr(clone_repos_by_date, "related_repos", [])
+    monkeypatch.setattr(clone_repos_by_date, "snapshot_urls", {})
+    return tmp_path / "work"
+
+
+def refs(repo_dir: str) -> list[str]:
+    return git(repo_dir, "for-each-ref", "--format=%(objectname) %(refname)").split("\n")
+
+
+def tree_state(folder: str) -> dict[str, str]:
+    """
+    {path: content} of every file in a snapshot, git metadata left out
+    """
+    state = {}
+    for root, dir_names, file_names in os.walk(folder):
+        if ".git" in dir_names:
+            dir_names.remove(".git")
+        for file_name in file_names:
+            if file_name == ".git":
+                continue
+            path = os.path.join(root, file_name)
+            with open(path) as file:
+                state[os.path.relpath(path, folder)] = file.read()
+    return state
+
+
+def test_mirror_skips_pull_refs(workspace, source_repo):
+    repo_url = f"file://{source_repo}"
+    mirror = clone_repos_by_date.mirror_path(repo_url)
+    assert clone_repos_by_date.update_mirror(repo_url, mirror)
+    # The second run fetches into the existing mirror
+    assert clone_repos_by_date.update_mirror(repo_url, mirror)
+
+    ref_names = [ref.split(" ", 1)[1] for ref in refs(mirror) if ref]
+    assert "refs/heads/main" in ref_names
+    assert "refs/tags/v1" in ref_names
+    assert not [name for name in ref_names if name.startswith("refs/pull/")]
+
+
+def test_mirror_drops_pull_refs_of_an_old_mirror_clone(workspace, source_repo):
+    repo_url = f"file://{source_repo}"
+    mirror = clone_repos_by_date.mirror_path(repo_url)
+    os.makedirs(os.path.dirname(mirror))
+    git(str(workspace), "clone", "-q", "--mirror", repo_url, mirror)
+    assert any("refs/pull/1/head" in ref for ref in refs(mirror))
+
+    assert clone_repos_by_date.update_mirror(repo_url, mirror)
+    assert not any("refs/pull/" in ref for ref in refs(mirror))
+
+
+@pytest.mark.parametrize("mode", sorted(clone_repos_by_date.snapshot_functions))
+def test_snapshot_rerun_is_idempotent(workspace, source_repo, mode):
+    repo_url = f"file://{source_repo}"
+    mirror = clone_repos_by_date.mirror_path(repo_url)
+    assert clone_repos_by_date.update_mirror(repo_url, mirror, clone_repos_by_date.mirror_filters.get(mode))
+
+    assert clone_repos_by_date.snapshot_dates(repo_url, dates, mode) == 2
+    first = {date: tree_state(clone_repos_by_date.snapshot_dir("owner", "project", date)) for date in dates}
+    worktrees = git(mirror, "worktree", "list")
+
+    assert clone_repos_by_date.snapshot_dates(repo_url, dates, mode) == 2
+    second = {date: tree_state(clone_repos_by_date.snapshot_dir("owner", "project", date)) for date in dates}
+
+    assert second == first
+    assert first["2022-03-01"]["app.py"] == "print('v1')\n"
+    assert first["2022-09-01"]["app.py"] == "print('v2')\n"
+    assert "pkg/new.py" not in first["2022-03-01"]
+    if mode in ("sparse", "hardlink", "archive"):
+        assert "README.md" not in first["2022-09-01"]
+    else:
+        assert "README.md" in first["2022-09-01"]
+    # No build folders left next to the snapshots, no extra worktrees in the mirror
+    assert sorted(os.listdir(os.path.join("cloned_commits", "2022-09-01", "owner", "project"))) == ["project"]
+    assert git(mirror, "worktree", "list") == worktrees
+
+
+def test_bundle_round_trip(workspace, source_repo, monkeypatch):
+    repo_url = f"file://{source_repo}"
+    mirror = clone_repos_by_date.mirror_path(repo_url)
+    assert clone_repos_by_date.update_mirror(repo_url, mirror)
+    clone_repos_by_date.export_bundles([repo_url], "bundles")
+
+    # An offline node: its own mirror folder, only the bundles to start from
+    monkeypatch.setattr(clone_repos_by_date, "mirror_dir", "offline_mirrors")
+    restored = clone_repos_by_date.mirror_path(repo_url)
+    clone_repos_by_date.import_bundles([repo_url], "bundles")
+    assert refs(restored) == refs(mirror)
+    assert git(restored, "config", "remote.origin.url").strip() == repo_url
+
+    # New history upstream goes over in a second, incremental bundle
+    commit(source_repo, {"app.py": "print('v3')\n"}, "2022-10-01")
+    monkeypatch.setattr(clone_repos_by_date, "mirror_dir", "repo_mirrors")
+    assert clone_repos_by_date.update_mirror(repo_url, mirror)
+    clone_repos_by_date.export_bundles([repo_url], "bundles")
+    bundle_folder = os.path.join("bundles", os.path.relpath(mirror, "repo_mirrors"))
+    assert sorted(name for name in os.listdir(bundle_folder) if name.endswith(".bundle")) == ["0001.bundle", "0002.bundle"]
+
+    monkeypatch.setattr(clone_repos_by_date, "mirror_dir", "offline_mirrors")
+    clone_repos_by_date.import_bundles([repo_url], "bundles")
+    assert refs(restored) == refs(mirror)
+    assert git(restored, "show", "HEAD:app.py") == "print('v3')\n"